@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+import sys
+import time
+from pathlib import Path
+import typer
+from loguru import logger
+from pynes import bits
+from pynes.ppu import PPU
+from pynes.cpu import CPU
+from pynes.bus import Bus
+from pynes.cartridge import Cartridge
+
+logger.remove()
+logger.add(sys.stderr, level="INFO")
+
+
+def run(rom: Path, ticks: int, checked: bool, video: str) -> float:
+    bits.set_checked(checked)
+    bus = Bus(video=video)
+    bus.connect(CPU())
+    bus.connect(PPU())
+    bus.connect_cartridge(Cartridge(str(rom)))
+    bus.reset()
+    ts = time.time()
+    while bus.nSystemClockCounter < ticks:
+        bus.clock()
+    return time.time() - ts
+
+
+def main(ticks:int=typer.Option(300000, '-n', '--ticks'), roms:Path=typer.Option(Path('roms'), '--roms'),
+         video:str=typer.Option('offscreen', '--video', help='pygame, offscreen or null')):
+    for rom in sorted(roms.glob('*.nes')):
+        fast = run(rom, ticks, checked=False, video=video)
+        checked = run(rom, ticks, checked=True, video=video)
+        logger.info(f'{rom.stem}: fast {fast:.2f}s, checked {checked:.2f}s ({checked / fast:.2f}x)')
+
+typer.run(main)
@@ -3,29 +3,77 @@ import sys
 import typer
 from pynes.ppu import PPU
 from pynes.cpu import CPU
-from pynes.bus import Bus
+from pynes.bus import Bus, FRAME_TICKS
 from pynes.cartridge import Cartridge
+from pynes.engine import Engine, ThreadedEngine
+from pynes.rewind import Rewind
 from loguru import logger
 import time
 
 logger.remove()
 logger.add(sys.stderr, level="INFO")
 
+def log_accesses(batch):
+    for access in batch:
+        logger.debug('{} 0x{:02x} at 0x{:04x}, cycle {}', access.kind, access.value, access.addr, access.cycle)
+
 @logger.catch
-def main(debug:int=typer.Option(-1, '-d', '--debug')):
+def main(debug:int=typer.Option(-1, '-d', '--debug'), step:bool=typer.Option(False, '--step'),
+         fused:bool=typer.Option(False, '--fused'), catch_up:bool=typer.Option(False, '--catch-up'),
+         idle_skip:bool=typer.Option(False, '--idle-skip'), blocks:bool=typer.Option(False, '--blocks'),
+         line_renderer:bool=typer.Option(False, '--line-renderer'),
+         video:str=typer.Option('pygame', '--video', help='pygame, offscreen or null'),
+         render_every:int=typer.Option(1, '--render-every', help='draw every Nth frame'),
+         scale:int=typer.Option(1, '--scale'), vsync:bool=typer.Option(False, '--vsync'),
+         pace:bool=typer.Option(False, '--pace', help='hold the window to 60.0988 frames a second'),
+         threaded:bool=typer.Option(False, '--threaded',
+                                    help='convert and pace frames on a presenter thread, the window stays on the main one'),
+         policy:str=typer.Option('block', '--policy', help='block, drop or overwrite when the presenter falls behind'),
+         frames:int=typer.Option(0, '--frames', help='run this many frames instead of 1000000 cycles'),
+         speed:float=typer.Option(0, '--speed', help='run at this multiple of real time, 0 for flat out'),
+         rewind_every:int=typer.Option(0, '--rewind-every', min=0,
+                                       help='capture a rewind snapshot every N frames, 0 for none'),
+         rewind_budget:int=typer.Option(32, '--rewind-budget', min=1, help='MiB of rewind snapshots to keep')):
+
+    if video == 'pygame':
+        video = Engine(scale=scale, vsync=vsync, pace=pace)
+        if threaded:
+            video = ThreadedEngine(video, policy=policy)
 
-    bus = Bus()
-    bus.connect(CPU())
-    bus.connect(PPU())
+    bus = Bus(catch_up=catch_up, idle_skip=idle_skip)
+    bus.connect(CPU(fused=fused, blocks=blocks))
+    bus.connect(PPU(line_renderer=line_renderer, render_every=render_every, video=video))
     # bus.connect_cartridge(Cartridge('roms/Tetris (USA) (Tengen) (Unl).nes'))
     # bus.connect_cartridge(Cartridge('roms/Pac-Man (USA) (Namco).nes'))
     bus.connect_cartridge(Cartridge('roms/full_palette.nes'))
     # bus.connect_cartridge(Cartridge('roms/helloworld.nes'))
     # bus.connect_cartridge(Cartridge('roms/starter.nes'))
     bus.reset()
+    rewind = Rewind(bus, interval=rewind_every, budget=rewind_budget * 1024 * 1024) if rewind_every else None
     DEBUG = False
 
     ts = time.time()
+    if step or catch_up or idle_skip or blocks or line_renderer or frames or speed or rewind:
+        if speed:
+            stats = bus.run_realtime(speed, frames=frames or None)
+        elif frames or rewind:
+            # rewind snapshots are captured between frames
+            stats = bus.run_frames(frames or round(1000000 / FRAME_TICKS))
+        else:
+            stats = bus.run_until(1000000)
+        logger.info(f'cycles: {bus.nSystemClockCounter}, cpu_cycle: {bus.cpu.clock_count}')
+        if idle_skip:
+            logger.info(f'idle cycles skipped: {bus.idle_cycles}')
+        if rewind:
+            rewind_stats = rewind.stats()
+            logger.info(f'rewind: {rewind_stats.snapshots} snapshots in {rewind_stats.size / 1024:.0f} KiB, '
+                        f'{rewind_stats.per_capture * 1000:.2f} ms a capture, '
+                        f'{rewind_stats.seconds / stats.seconds:.1%} of the run')
+        logger.info(f'time spend: {stats.seconds}, {stats.frames} frames at {stats.fps:.1f} fps, '
+                    f'{stats.clock_rate / 1e6:.3f} MHz master clock')
+        # a threaded backend still shows the frames it has queued
+        bus.ppu.engine.close()
+        return
     while True:
         c = bus.nSystemClockCounter
         cpu_cycle = bus.cpu.clock_count
@@ -34,6 +82,7 @@ def main(debug:int=typer.Option(-1, '-d', '--debug')):
             logger.info(f'cycles: {c}, cpu_cycle: {cpu_cycle}')
         if c == 1000000:
             logger.info(f'time spend: {time.time() - ts}')
+            bus.ppu.engine.close()
             break
         bus.clock()
         #[86694, 655061] target 655061
@@ -42,6 +91,8 @@ def main(debug:int=typer.Option(-1, '-d', '--debug')):
             bus.cpu.debug = True
             logger.remove()
             logger.add(sys.stderr, level="DEBUG")
+            bus.add_observer(log_accesses, batch_size=1)
+            bus.ppu.add_observer(log_accesses, batch_size=1)
         if c % 3 == 0:
             if DEBUG and debug_ready:
                 input('pause')
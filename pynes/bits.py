@@ -1,4 +1,9 @@
-from typing import List, Tuple
+import os
+from typing import Callable, List, Optional, Tuple
+
+# checked builds validate register and bus values on every access; set
+# PYNES_CHECKED=1 or call set_checked(True) before constructing devices
+CHECKED = bool(os.environ.get('PYNES_CHECKED'))
 
 def uint8(init_val: int = 0) -> int:
     return init_val & 0xFF
@@ -20,6 +25,23 @@ def assert_u8(d:int)->None:
     # return
     assert 0x00 <= d <= 0xff
 
+def set_checked(flag: bool) -> None:
+    global CHECKED
+    CHECKED = flag
+
+def is_checked() -> bool:
+    return CHECKED
+
+def checked(method: Callable, args: Tuple[Callable] = (), result: Optional[Callable] = None) -> Callable:
+    def wrapper(*values, **kwargs):
+        for check, value in zip(args, values + tuple(kwargs.values())):
+            check(value)
+        data = method(*values, **kwargs)
+        if result is not None and data is not False:
+            result(data)
+        return data
+    return wrapper
+
 def flipbyte(b):
     b = (b & 0xF0) >> 4 | (b & 0x0F) << 4
     b = (b & 0xCC) >> 2 | (b & 0x33) << 2
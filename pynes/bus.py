@@ -1,17 +1,57 @@
+import time
+from struct import Struct
+from collections import namedtuple
 from pynes.bits import mtx
 from pynes.bits import assert_u16, assert_u8
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Tuple, Union
 
 from pynes.bits import t8, t16, u16, u8
 from pynes.cartridge import Cartridge
 from pynes.cpu import CPU
 from pynes.ppu import PPU
 from pynes.device import Device
-import loguru
+from pynes.engine import VideoBackend, make_engine, Pacer, FRAME_RATE
+from pynes.trace import Traceable, READ, WRITE
 
+# idle loop detection: the longest backward jump and the most instructions in
+# a loop body that are considered
+IDLE_LOOP_BYTES = 16
+IDLE_LOOP_STEPS = 8
 
-class Bus(Device):
-    def __init__(self, address_count: int = 16, data_count: int = 8, name: str = '') -> None:
+# master clock ticks in a frame of 262 scanlines of 341 dots
+FRAME_TICKS = 262 * 341
+
+# save states: magic, format version, section count and the hash of the ROM
+# they belong to, then each device's pack_state() prefixed with its length,
+# see Bus.save_state()
+STATE_MAGIC = b'PYNS'
+STATE_VERSION = 1
+STATE_HEADER = Struct('<4sHH20s')
+STATE_SECTION = Struct('<I')
+
+
+class RunStats(namedtuple('RunStats', 'frames ticks seconds')):
+    # what a run loop emulated and how long it took
+    @property
+    def fps(self) -> float:
+        return self.frames / self.seconds if self.seconds else 0.0
+
+    @property
+    def clock_rate(self) -> float:
+        # master clock ticks per second
+        return self.ticks / self.seconds if self.seconds else 0.0
+
+
+class Bus(Device, Traceable):
+    CHECKS = {
+        'read': ((assert_u16,), assert_u8),
+        'write': ((assert_u16, assert_u8), None),
+    }
+    STATE = ('nSystemClockCounter', 'dma_page', 'dma_addr', 'dma_data', 'dma_dummy', 'dma_transfer', 'dma_stall')
+    STATE_BUFFERS = ('cpuRam', 'controller', 'controller_state')
+
+    def __init__(self, address_count: int = 16, data_count: int = 8, name: str = '', catch_up: bool = False,
+                 idle_skip: bool = False, video: Union[str, VideoBackend] = None) -> None:
         super().__init__(name=name)
         self.address_count = address_count
         self.data_count = data_count
@@ -26,8 +66,30 @@ class Bus(Device):
         self.dma_data = u8()
         self.dma_dummy = True
         self.dma_transfer = False
+        # CPU cycles still owed to a DMA that was copied in one go
+        self.dma_stall = 0
         self.cpu = None
         self.ppu = None
+        # video backend handed to the PPU on connect, None keeps the PPU's own
+        self.video = video
+        # lazy PPU: master ticks the PPU is behind, and the lag at which vblank is due
+        self.catch_up = catch_up
+        self.ppu_lag = 0
+        self.ppu_deadline = 0
+        # step() fast-forwards loops that only wait for the PPU, counting the
+        # CPU cycles it skipped
+        self.idle_skip = idle_skip
+        self.idle_cycles = 0
+        self.idle_probe = False
+        self.idle_clean = True
+        self.idle_ppu = 0
+        self.idle_status = 0
+        # pynes.rewind.Rewind attached to this bus, told of every frame run_frames() runs
+        self.rewind = None
+        self.read_pages = [None] * 256
+        self.write_pages = [None] * 256
+        self.map_pages()
+        self.init_trace()
 
     def connect(self, device: Device, name: str = None) -> None:
         if isinstance(device, CPU):
@@ -35,53 +97,133 @@ class Bus(Device):
             self.cpu = device
         if isinstance(device, PPU):
             self.ppu = device
+            if self.video is not None:
+                device.set_engine(make_engine(self.video))
             if self.cartridge:
-                self.ppu.cartridge = self.cartridge
+                self.ppu.ConnectCartridge(self.cartridge)
 
     def connect_cartridge(self, cart: Cartridge):
         self.cartridge = cart
         if self.ppu:
-            self.ppu.cartridge = cart
+            self.ppu.ConnectCartridge(cart)
+        cart.mapper.add_listener(self.map_pages, ppu=False)
+        self.map_pages()
+
+    def map_pages(self) -> None:
+        # one (memory, offset) entry per 256 byte page, memory is None for pages
+        # served by a handler, which then sits in place of the offset
+        mapper = self.cartridge.mapper if self.cartridge else None
+        read_pages = self.read_pages[:]
+        for page in range(256):
+            addr = page << 8
+            mapped_addr, mapped = mapper.cpuMapRead(addr) if mapper else (0, False)
+            if mapped and mapper.cpuMapRead(addr | 0xFF) == (mapped_addr + 0xFF, True):
+                self.read_pages[page] = (self.cartridge.vPRGMemory, mapped_addr)
+            elif mapped:
+                self.read_pages[page] = (None, self.read_device)
+            elif addr <= 0x1FFF:
+                self.read_pages[page] = (self.cpuRam, addr & 0x0700)
+            elif addr <= 0x3FFF:
+                self.read_pages[page] = (None, self.read_ppu_register)
+            else:
+                self.read_pages[page] = (None, self.read_device)
+            if addr <= 0x1FFF:
+                self.write_pages[page] = (self.cpuRam, addr & 0x0700)
+            elif addr <= 0x3FFF:
+                self.write_pages[page] = (None, self.write_ppu_register)
+            else:
+                self.write_pages[page] = (None, self.write_device)
+        if self.cpu and self.cpu.blocks and read_pages != self.read_pages:
+            self.cpu.flush_blocks()
+        if self.cpu and self.cpu.ram_code:
+            self.watch_ram_code()
+
+    def watch_ram_code(self) -> None:
+        # RAM holds translated code, so writes to it go through a handler
+        for page in range(0x20):
+            self.write_pages[page] = (None, self.write_ram_code)
+
+    def write_ram_code(self, addr: t16, data: t8) -> None:
+        self.cpuRam[addr & 0x07FF] = data
+        if addr & 0x07FF in self.cpu.ram_code:
+            self.cpu.drop_ram_code(addr & 0x07FF)
 
     def read(self, addr: t16) -> t8:
-        assert_u16(addr)
-        addr = u16(addr)
-        data = self.cartridge.read(addr)
+        memory, offset = self.read_pages[addr >> 8]
+        if memory is None:
+            return offset(addr)
+        return memory[offset | (addr & 0xFF)]
+
+    def write(self, addr: t16, data: t8) -> None:
+        memory, offset = self.write_pages[addr >> 8]
+        if memory is None:
+            offset(addr, data)
+        else:
+            memory[offset | (addr & 0xFF)] = data
+
+    def traced_read(self, addr: t16) -> t8:
+        data = Bus.read(self, addr)
+        self.record(addr, data, READ, self.nSystemClockCounter)
+        return data
+
+    def traced_write(self, addr: t16, data: t8) -> None:
+        Bus.write(self, addr, data)
+        self.record(addr, data, WRITE, self.nSystemClockCounter)
+
+    def install_trace(self, enabled: bool) -> None:
+        if enabled:
+            self.read = self.traced_read
+            self.write = self.traced_write
+        else:
+            del self.read, self.write
+        self.install_checks('read', 'write')
+        if self.cpu:
+            self.cpu.connect_bus(self)
+
+    def read_ppu_register(self, addr: t16) -> t8:
+        if self.ppu_lag:
+            self.sync_ppu()
+        return self.ppu.read(addr & 0x0007)
+
+    def write_ppu_register(self, addr: t16, data: t8) -> None:
+        if self.ppu_lag:
+            self.sync_ppu()
+        self.ppu.write(addr & 0x0007, data)
+
+    def read_device(self, addr: t16) -> t8:
+        data = self.cartridge.read(addr) if self.cartridge else False
         if data is not False:
-            loguru.logger.debug('0x{:02x} read from cartridge at 0x{:04x}', data, addr)
-        elif 0x0000 <= addr <= 0x1FFF:
-            data = self.cpuRam[addr & 0x07FF]
-            loguru.logger.debug('0x{:02x} read from cpuRam at 0x{:04x}', data, addr)
-        elif 0x2000 <= addr <= 0x3FFF:
-            data = self.ppu.read(addr & 0x0007)
-            loguru.logger.debug('0x{:02x} read from ppu at 0x{:04x}', data, addr)
-        elif 0x4016 <= addr <= 0x4017:
+            return data
+        if 0x4016 <= addr <= 0x4017:
             data = int((self.controller_state[addr & 0x0001] & 0x80) > 0)
-            loguru.logger.debug('0x{:02x} read from controller at 0x{:04x}', data, addr)
-            self.controller_state[addr & 0x0001] = u16(self.controller_state[addr & 0x0001] << 1)
-        assert_u8(data)
-        return data
+            self.controller_state[addr & 0x0001] = (self.controller_state[addr & 0x0001] << 1) & 0xFF
+            return data
+        return 0
 
-    def write(self, addr: t16, data: t8) -> None:
-        assert_u16(addr)
-        assert_u8(data)
-        if self.cartridge.write(addr, data):
-            loguru.logger.debug('0x{:02x} write to cart at 0x{:04x}', data, addr)
-        elif 0x0000 <= addr <= 0x1FFF:
-            self.cpuRam[addr & 0x07FF] = data
-            loguru.logger.debug('0x{:02x} write to cpuRam at 0x{:04x}', data, addr)
-        elif 0x2000 <= addr <= 0x3FFF:
-            self.ppu.write(addr & 0x0007, data)
-            loguru.logger.debug('0x{:02x} write to ppu at 0x{:04x}', data, addr)
-        elif addr == 0x4014:
-            loguru.logger.debug('dma start, page {:02x} at 0x{:04x}', data, addr)
+    def write_device(self, addr: t16, data: t8) -> None:
+        if self.ppu_lag and (addr >= 0x8000 or addr == 0x4014):
+            self.sync_ppu()
+        if self.cartridge and self.cartridge.write(addr, data):
+            # the write may have landed in PRG that translated blocks were made from
+            if self.cpu and self.cpu.blocks:
+                self.cpu.flush_blocks()
+            return
+        if addr == 0x4014:
             self.dma_page = data
             self.dma_addr = 0x00
             self.dma_transfer = True
+            memory, offset = self.read_pages[data]
+            if memory is not None and not self.observers:
+                self.oam_dma(memory, offset)
         elif 0x4016 <= addr <= 0x4017:
-            loguru.logger.debug('controller write to controller_state at 0x{:04x}', addr)
             self.controller_state[addr & 0x0001] = self.controller[addr & 0x0001]
 
+    def oam_dma(self, memory: list, offset: int) -> None:
+        # the source page has no side effects, so copy it now and let clock/step
+        # charge the 513 cycles (514 when the write lands on an odd cycle)
+        self.ppu.OAM[:] = bytes(memory[offset:offset + 256])
+        self.dma_stall = 513 + (self.nSystemClockCounter & 1)
+
     def reset(self) -> None:
         if self.cartridge:
             self.cartridge.reset()
@@ -95,22 +237,81 @@ class Bus(Device):
         self.dma_data = 0x00
         self.dma_dummy = True
         self.dma_transfer = False
+        self.dma_stall = 0
+        self.ppu_lag = 0
+        if self.ppu:
+            self.ppu_deadline = self.ppu.ticks_until_vblank()
+
+    def state_devices(self) -> list:
+        return [self, self.cpu, self.ppu, self.cartridge, self.cartridge.mapper]
 
+    def save_state(self) -> bytes:
+        # the whole machine as a compact blob for load_state(); a lazy PPU is
+        # caught up first so the blob never holds owed ticks
+        self.sync_ppu()
+        sections = [device.pack_state() for device in self.state_devices()]
+        return STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(sections), self.cartridge.rom_hash) + \
+            b''.join(STATE_SECTION.pack(len(section)) + section for section in sections)
+
+    def load_state(self, state: bytes) -> None:
+        if len(state) < STATE_HEADER.size:
+            raise ValueError('save state is truncated')
+        magic, version, count, rom_hash = STATE_HEADER.unpack_from(state)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise ValueError(f'not a version {STATE_VERSION} save state')
+        if rom_hash != self.cartridge.rom_hash:
+            raise ValueError(f'save state is not of {self.cartridge.name}')
+        devices = self.state_devices()
+        if count != len(devices):
+            raise ValueError(f'save state has {count} sections, expected {len(devices)}')
+        offset = STATE_HEADER.size
+        sections = []
+        for _ in devices:
+            if len(state) < offset + STATE_SECTION.size:
+                raise ValueError('save state is truncated')
+            size, = STATE_SECTION.unpack_from(state, offset)
+            offset += STATE_SECTION.size
+            sections.append(state[offset:offset + size])
+            offset += size
+        if offset != len(state):
+            raise ValueError(f'save state is {len(state)} bytes, its sections take {offset}')
+        # nothing is changed unless every section fits
+        for device, section in zip(devices, sections):
+            device.check_state(section)
+        for device, section in zip(devices, sections):
+            device.unpack_state(section)
+        # code and bank mappings may have changed under the CPU and the PPU
+        if self.cpu.blocks is not None:
+            self.cpu.flush_blocks()
+        self.cartridge.mapper.notify()
+        self.ppu_lag = 0
+        self.ppu_deadline = self.ppu.ticks_until_vblank()
+
+    def sync_ppu(self) -> None:
+        if self.ppu_lag:
+            self.ppu.run(self.ppu_lag)
+            self.ppu_lag = 0
+        self.ppu_deadline = self.ppu.ticks_until_vblank()
 
     def clock(self) -> None:
         self.ppu.clock()
         if self.nSystemClockCounter % 3 == 0:
             if self.dma_transfer:
                 self.cpu.clock_count += 1
-                if self.dma_dummy:
+                if self.dma_stall:
+                    self.dma_stall -= 1
+                    if self.dma_stall == 0:
+                        self.cpu.clock_count += 1
+                        self.dma_transfer = False
+                elif self.dma_dummy:
                     if self.nSystemClockCounter % 2 == 1:
                         self.dma_dummy = False
                 else:
                     if self.nSystemClockCounter % 2 == 0:
                         self.dma_data = self.read(self.dma_page << 8 | self.dma_addr)
                     else:
-                        self.ppu.OAM[self.dma_addr // 4][self.dma_addr % 4] = self.dma_data
-                        self.dma_addr = u8(self.dma_addr + 1)
+                        self.ppu.OAM[self.dma_addr] = self.dma_data
+                        self.dma_addr = (self.dma_addr + 1) & 0xFF
                         if self.dma_addr == 0:
                             self.cpu.clock_count += 1
                             self.dma_transfer = False
@@ -123,6 +324,146 @@ class Bus(Device):
             self.cpu.nmi()
         self.nSystemClockCounter += 1
 
+    def step(self, limit: int = None) -> int:
+        # runs an instruction, or a DMA, and returns the master ticks it took;
+        # translated blocks and idle loop skips take no more than limit ticks in all
+        start = self.nSystemClockCounter
+        if self.dma_transfer or start % 3:
+            self.sync_ppu()
+            while self.dma_transfer or self.nSystemClockCounter % 3:
+                self.clock()
+            self.sync_ppu()
+            return self.nSystemClockCounter - start
+        pc = self.cpu.pc
+        if self.cpu.blocks is None or self.observers:
+            # blocks fetch their code ahead of time, out of sight of observers
+            ticks = 3 * self.cpu.step()
+        else:
+            # whole blocks only when they end before vblank, so NMI stays on time
+            budget = self.ppu_deadline - self.ppu_lag if self.catch_up else self.ppu.ticks_until_vblank()
+            if limit is not None:
+                budget = min(budget, limit)
+            ticks = 3 * self.cpu.step_block(budget // 3)
+        if self.dma_stall:
+            ticks += 3 * self.dma_stall
+            self.cpu.clock_count += self.dma_stall + 1
+            self.dma_stall = 0
+            self.dma_transfer = False
+        self.nSystemClockCounter += ticks
+        if self.catch_up:
+            self.ppu_lag += ticks
+            if self.ppu_lag >= self.ppu_deadline:
+                self.sync_ppu()
+        else:
+            self.ppu.run(ticks)
+        if self.idle_skip and not self.idle_probe and 0 <= pc - self.cpu.pc <= IDLE_LOOP_BYTES and not self.ppu.nmi \
+                and (limit is None or limit > ticks):
+            ticks += self.skip_idle_loop(None if limit is None else limit - ticks)
+        if self.ppu.nmi:
+            self.cpu.clock_count += 1
+            self.ppu.nmi = False
+            self.cpu.nmi()
+        return ticks
+
+    def run_until(self, cycle: int) -> RunStats:
+        # runs whole instructions as fast as they go until the master clock reaches cycle
+        start, frame, ts = self.nSystemClockCounter, self.ppu.n_frame, time.perf_counter()
+        step = self.step
+        while self.nSystemClockCounter < cycle:
+            step(cycle - self.nSystemClockCounter)
+        self.sync_ppu()
+        return RunStats(self.ppu.n_frame - frame, self.nSystemClockCounter - start, time.perf_counter() - ts)
+
+    def run_frames(self, n: int) -> RunStats:
+        if self.rewind is None:
+            return self.run_until(self.nSystemClockCounter + n * FRAME_TICKS)
+        start, frame, ts = self.nSystemClockCounter, self.ppu.n_frame, time.perf_counter()
+        for _ in range(n):
+            self.run_until(self.nSystemClockCounter + FRAME_TICKS)
+            self.rewind.frame_done()
+        return RunStats(self.ppu.n_frame - frame, self.nSystemClockCounter - start, time.perf_counter() - ts)
+
+    def run_realtime(self, speed: float = 1.0, frames: int = None) -> RunStats:
+        # runs a frame's worth at a time, paced to speed times the NES frame
+        # rate, until frames are done or the video backend is closed
+        pacer = Pacer(FRAME_RATE * speed)
+        start, frame, ts = self.nSystemClockCounter, self.ppu.n_frame, time.perf_counter()
+        done = 0
+        while (frames is None or done < frames) and not self.ppu.engine.finished:
+            self.run_frames(1)
+            pacer.wait()
+            done += 1
+        return RunStats(self.ppu.n_frame - frame, self.nSystemClockCounter - start, time.perf_counter() - ts)
+
+    def idle_read(self, addr: t16) -> t8:
+        data = self.read(addr)
+        if self.read_pages[addr >> 8][0] is not None:
+            pass
+        elif 0x2000 <= addr <= 0x3FFF and addr & 0x0007 == 0x0002 and not data & 0x80:
+            # reading the status has no lasting effect while vblank is clear
+            self.idle_ppu += 1
+            self.idle_status = data & 0xE0
+        else:
+            self.idle_clean = False
+        return data
+
+    def idle_write(self, addr: t16, data: t8) -> None:
+        self.write(addr, data)
+        self.idle_clean = False
+
+    def skip_idle_loop(self, limit: int = None) -> int:
+        # the CPU just jumped back a few bytes: run one more pass of the loop
+        # watching its accesses. If it only read memory, or polled the PPU
+        # status in its first instruction, and came back to the same state,
+        # every further pass is identical until the status changes or vblank
+        # raises NMI, so run the PPU up to that point without the CPU. Neither
+        # the watched pass nor the skip go on past limit ticks
+        cpu, ppu = self.cpu, self.ppu
+        start = cpu.pc
+        state = (cpu.a, cpu.x, cpu.y, cpu.stkp, cpu.status)
+        self.idle_probe, self.idle_clean, self.idle_ppu = True, True, 0
+        cpu.read, cpu.write = self.idle_read, self.idle_write
+        period = 0
+        for i in range(IDLE_LOOP_STEPS):
+            period += self.step()
+            if i == 0:
+                polls = self.idle_ppu
+            if cpu.pc == start or not self.idle_clean or (limit is not None and period >= limit):
+                break
+        cpu.connect_bus(self)
+        self.idle_probe = False
+        if not self.idle_clean or self.idle_ppu != polls or cpu.pc != start or \
+                state != (cpu.a, cpu.x, cpu.y, cpu.stkp, cpu.status):
+            return period
+        self.sync_ppu()
+        # stay a pass short of vblank, and of the pre-render line when polling
+        horizon = ppu.ticks_until_vblank()
+        if polls:
+            horizon = min(horizon, ppu.ticks_until(-1, 1))
+        passes = horizon // period - 1
+        if limit is not None:
+            passes = min(passes, (limit - period) // period)
+        if passes <= 0:
+            return period
+        if polls:
+            # sprite 0 hit and overflow may change the status on any pass
+            done = 0
+            while done < passes and ppu.status & 0xE0 == self.idle_status:
+                ppu.run(period)
+                done += 1
+            skip = done * period
+            self.sync_ppu()
+        else:
+            skip = passes * period
+            if self.catch_up:
+                self.ppu_lag += skip
+            else:
+                ppu.run(skip)
+        self.nSystemClockCounter += skip
+        cpu.clock_count += skip // 3
+        self.idle_cycles += skip // 3
+        return period + skip
+
 
 if __name__ == '__main__':
     print(Bus())
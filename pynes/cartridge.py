@@ -1,25 +1,50 @@
+import hashlib
 from pathlib import Path
-from struct import unpack_from
+from struct import Struct, unpack_from
 from collections import namedtuple
 
 from loguru import logger
 from pynes.mapper import Mapper, Mapper003, Mapper000
-from pynes.bits import uint8, uint16, u8, u16, t16, t8, assert_u16
+from pynes.bits import uint8, uint16, u8, u16, t16, t8, assert_u16, assert_u8, flipbyte
 from pynes.device import Device
 
 Header = namedtuple('Header',
                     'name prg_rom_chunks chr_rom_chunks mapper1 mapper2 prg_ram_size tv_system1 tv_system2')
 
+# a decoded 8x8 CHR tile: the 16 pattern bytes (8 low plane rows, then 8 high),
+# the same with every byte mirrored, and 8 rows of 2-bit pixels left to right
+Tile = namedtuple('Tile', 'planes flipped_planes pixels')
+# offset and value of a PRG byte in a save state, see Cartridge.pack_state()
+PRG_PATCH = Struct('<IB')
+
 HORIZONTAL = 0
 VERTICAL = 1
 ONESCREEN_LO = 2
 ONESCREEN_HI = 3
+FOURSCREEN = 4
+
+def decode_tile(memory: list, offset: int) -> Tile:
+    planes = bytes(memory[offset:offset + 16])
+    pixels = tuple(bytes(((hi >> bit) & 1) << 1 | ((lo >> bit) & 1) for bit in range(7, -1, -1))
+                   for lo, hi in zip(planes[:8], planes[8:]))
+    return Tile(planes, bytes(flipbyte(b) for b in planes), pixels)
 
 class Cartridge(Device):
+    CHECKS = {
+        'read': ((assert_u16,), assert_u8),
+        'write': ((assert_u16, assert_u8), None),
+        'ppuRead': ((assert_u16,), assert_u8),
+        'ppuWrite': ((assert_u16, assert_u8), None),
+    }
+    # PRG ROM is left out of save states but for the bytes written over, see pack_state()
+    STATE_BUFFERS = ('vCHRMemory', 'vNameMemory')
+
     def __init__(self, file_name: str) -> None:
         self.file_name = Path(file_name)
         super().__init__(name=self.file_name.stem)
         data = self.file_name.read_bytes()
+        # save states only load into the ROM they were saved from
+        self.rom_hash = hashlib.sha1(data).digest()
         self.nMapperID = u8()
         self.nPRGBanks = u8()
         self.nCHRBanks = u8()
@@ -35,7 +60,13 @@ class Cartridge(Device):
         if header.mapper1 & 0x04:
             offset += 512
         self.nMapperID = ((header.mapper2 >> 4) << 4) | (header.mapper1 >> 4)
-        self.mirror = VERTICAL if header.mapper1 & 0x01 else HORIZONTAL
+        # mirroring wired on the board, mappers may switch it, see map_mirror()
+        self.hw_mirror = VERTICAL if header.mapper1 & 0x01 else HORIZONTAL
+        if header.mapper1 & 0x08:
+            self.hw_mirror = FOURSCREEN
+        self.mirror = self.hw_mirror
+        # the extra 2 KiB of nametable RAM four-screen boards carry
+        self.vNameMemory = bytearray(2 * 1024) if self.hw_mirror == FOURSCREEN else None
 
         logger.info(f'using mapper {self.nMapperID}')
 
@@ -50,12 +81,15 @@ class Cartridge(Device):
             self.nPRGBanks = header.prg_rom_chunks
             self.vPRGMemory = list(unpack_from(f'{self.nPRGBanks * 16 * 1024}B', data, offset=offset))
             offset += self.nPRGBanks * 16 * 1024
+            self.prg_rom = bytes(self.vPRGMemory)
             if self.nCHRBanks == 0:
                 CBanks = 1
             else:
                 CBanks = self.nCHRBanks
             self.vCHRMemory = list(unpack_from(f'{CBanks * 8 * 1024}B', data, offset=offset))
             offset += CBanks * 8 * 1024
+        # decoded tiles of vCHRMemory, filled in by tile() and dropped on CHR-RAM writes
+        self.tiles = [None] * (len(self.vCHRMemory) // 16)
 
         # if (nFileType == 2)
         # {
@@ -85,14 +119,18 @@ class Cartridge(Device):
             3: Mapper003,
         }
         self.mapper = mappers.get(self.nMapperID, Mapper)(self.nPRGBanks, self.nCHRBanks)
+        self.mapper.add_listener(self.map_mirror, cpu=False)
         self.bImageValid = True
 
 
+    def map_mirror(self) -> None:
+        mirror = self.mapper.mirror()
+        self.mirror = self.hw_mirror if mirror is None else mirror
+
     def image_valid(self) -> bool:
         return self.bImageValid
 
     def read(self, addr: t16) -> t8:
-        assert_u16(addr)
         mapped_addr, result = self.mapper.cpuMapRead(addr)
         if result:
             return self.vPRGMemory[mapped_addr]
@@ -100,7 +138,6 @@ class Cartridge(Device):
             return False
 
     def write(self, addr: t16, data: t8) -> None:
-        assert_u16(addr)
         mapped_addr, result = self.mapper.cpuMapWrite(addr, data)
         if result:
             self.vPRGMemory[mapped_addr] = data
@@ -109,7 +146,6 @@ class Cartridge(Device):
             return False
     
     def ppuRead(self, addr: t16) -> t8:
-        assert_u16(addr)
         mapped_addr, result = self.mapper.ppuMapRead(addr)
         if result:
             return self.vCHRMemory[mapped_addr]
@@ -117,14 +153,47 @@ class Cartridge(Device):
             return False
 
     def ppuWrite(self, addr: t16, data: t8) -> None:
-        assert_u16(addr)
         mapped_addr, result = self.mapper.ppuMapWrite(addr, data)
         if result:
             self.vCHRMemory[mapped_addr] = data
+            self.tiles[mapped_addr >> 4] = None
             return True
         else:
             return False
     
+    def tile(self, index: int) -> Tile:
+        tile = self.tiles[index]
+        if tile is None:
+            tile = self.tiles[index] = decode_tile(self.vCHRMemory, index << 4)
+        return tile
+
+    def pack_state(self) -> bytes:
+        # followed by an (offset, value) patch for each PRG byte that differs from the ROM
+        prg = bytes(self.vPRGMemory)
+        if prg == self.prg_rom:
+            return super().pack_state()
+        return super().pack_state() + b''.join(PRG_PATCH.pack(offset, value) for offset, (value, rom)
+                                               in enumerate(zip(prg, self.prg_rom)) if value != rom)
+
+    def check_state(self, data: bytes) -> None:
+        size = self.state_size()
+        if len(data) < size or (len(data) - size) % PRG_PATCH.size:
+            raise ValueError(f'state of {len(data)} bytes does not fit {self.name}')
+        if any(offset >= len(self.prg_rom) for offset, _ in PRG_PATCH.iter_unpack(data[size:])):
+            raise ValueError(f'state patches PRG outside of {self.name}')
+
+    def unpack_state(self, data: bytes) -> None:
+        size = self.state_size()
+        chr_memory = self.vCHRMemory[:]
+        self.check_state(data)
+        super().unpack_state(data[:size])
+        if self.vCHRMemory != chr_memory:
+            self.tiles = [None] * len(self.tiles)
+        if data[size:] or bytes(self.vPRGMemory) != self.prg_rom:
+            self.vPRGMemory[:] = self.prg_rom
+            for offset, value in PRG_PATCH.iter_unpack(data[size:]):
+                self.vPRGMemory[offset] = value
+
     def reset(self) -> None:
         if self.mapper:
             self.mapper.reset()
@@ -0,0 +1,392 @@
+import re
+from functools import lru_cache
+from typing import Callable, List, Tuple
+from pynes.flags import NZ_FLAGS, NZ_RESULT, ADC_TABLE, SBC_TABLE, CMP_TABLE
+
+# Python source templates for the 6502 instruction set. Registers live in
+# locals named A, X, Y, SP, P and PC, with P holding every flag but N and Z,
+# which are derived from the last result in R (see pynes.flags); an addressing
+# mode leaves the effective address in ADDR (or the branch offset in REL) and
+# sets PAGE when it crossed a page boundary; an operation reads its operand
+# from V and may add branch cycles to EXTRA.
+
+ADDRESS_MODES = {
+    'IMP': '',
+    'IMM': '''
+        ADDR = PC
+        PC = (PC + 1) & 0xFFFF
+    ''',
+    'ZP0': '''
+        ADDR = read(PC)
+        PC = (PC + 1) & 0xFFFF
+    ''',
+    'ZPX': '''
+        ADDR = (read(PC) + X) & 0xFF
+        PC = (PC + 1) & 0xFFFF
+    ''',
+    'ZPY': '''
+        ADDR = (read(PC) + Y) & 0xFF
+        PC = (PC + 1) & 0xFFFF
+    ''',
+    'REL': '''
+        REL = read(PC)
+        PC = (PC + 1) & 0xFFFF
+        if REL & 0x80:
+            REL |= 0xFF00
+    ''',
+    'ABS': '''
+        ADDR = read(PC) | (read((PC + 1) & 0xFFFF) << 8)
+        PC = (PC + 2) & 0xFFFF
+    ''',
+    'ABX': '''
+        ADDR = read(PC) | (read((PC + 1) & 0xFFFF) << 8)
+        PC = (PC + 2) & 0xFFFF
+        PAGE = ((ADDR & 0xFF) + X) >> 8
+        ADDR = (ADDR + X) & 0xFFFF
+    ''',
+    'ABY': '''
+        ADDR = read(PC) | (read((PC + 1) & 0xFFFF) << 8)
+        PC = (PC + 2) & 0xFFFF
+        PAGE = ((ADDR & 0xFF) + Y) >> 8
+        ADDR = (ADDR + Y) & 0xFFFF
+    ''',
+    'IND': '''
+        LO = read(PC)
+        HI = read((PC + 1) & 0xFFFF)
+        PC = (PC + 2) & 0xFFFF
+        PTR = (HI << 8) | LO
+        if LO == 0xFF:
+            ADDR = (read(PTR & 0xFF00) << 8) | read(PTR)
+        else:
+            ADDR = (read(PTR + 1) << 8) | read(PTR)
+    ''',
+    'IZX': '''
+        T = read(PC)
+        PC = (PC + 1) & 0xFFFF
+        ADDR = read((T + X) & 0xFF) | (read((T + X + 1) & 0xFF) << 8)
+    ''',
+    'IZY': '''
+        T = read(PC)
+        PC = (PC + 1) & 0xFFFF
+        LO = read(T & 0xFF)
+        HI = read((T + 1) & 0xFF)
+        PAGE = (LO + Y) >> 8
+        ADDR = ((HI << 8 | LO) + Y) & 0xFFFF
+    ''',
+}
+
+
+def _branch(cond: str) -> str:
+    return f'''
+        if {cond}:
+            ADDR = (PC + REL) & 0xFFFF
+            EXTRA += 1 + ((ADDR & 0xFF00) != (PC & 0xFF00))
+            PC = ADDR
+    '''
+
+
+def _load(reg: str) -> str:
+    return f'''
+        {reg} = V
+        R = {reg}
+    '''
+
+
+def _transfer(dst: str, src: str) -> str:
+    return f'''
+        {dst} = {src}
+        R = {dst}
+    '''
+
+
+def _step(reg: str, delta: str) -> str:
+    return f'''
+        {reg} = ({reg} {delta} 1) & 0xFF
+        R = {reg}
+    '''
+
+
+def _compare(reg: str) -> str:
+    return f'''
+        T = CMP[{reg} << 8 | V]
+        P = (P & 0xFE) | (T >> 8)
+        R = T & 0xFF
+    '''
+
+
+def _logic(op: str) -> str:
+    return f'''
+        A {op}= V
+        R = A
+    '''
+
+
+def _memory(op: str) -> str:
+    return f'''
+        T = (V {op} 1) & 0xFF
+        write(ADDR, T)
+        R = T
+    '''
+
+
+_PUSH = '''
+        write(0x0100 + SP, {})
+        SP = (SP - 1) & 0xFF
+'''
+
+_PULL = '''
+        SP = (SP + 1) & 0xFF
+        {} = read(0x0100 + SP)
+'''
+
+# operations whose operand is read through fetch()
+FETCHES = {'ADC', 'SBC', 'AND', 'ASL', 'BIT', 'CMP', 'CPX', 'CPY', 'DEC', 'EOR',
+           'INC', 'LDA', 'LDX', 'LDY', 'LSR', 'ORA', 'ROL', 'ROR'}
+# operations that take the extra page-crossing cycle of ABX/ABY/IZY
+PAGE_SENSITIVE = {'ADC', 'SBC', 'AND', 'CMP', 'EOR', 'LDA', 'LDX', 'LDY', 'ORA'}
+PAGE_SENSITIVE_NOPS = {0x1C, 0x3C, 0x5C, 0x7C, 0xDC, 0xFC}
+# operations that write their result back to A (implied) or memory
+SHIFTS = {'ASL', 'LSR', 'ROL', 'ROR'}
+# operations that write memory when not implied
+WRITES = SHIFTS | {'STA', 'STX', 'STY', 'INC', 'DEC'}
+# operations after which a basic block cannot go on
+BLOCK_ENDS = {'BCC', 'BCS', 'BEQ', 'BNE', 'BMI', 'BPL', 'BVC', 'BVS', 'JMP', 'JSR', 'RTS', 'RTI', 'BRK'}
+OPERAND_BYTES = {'IMP': 0, 'IMM': 1, 'ZP0': 1, 'ZPX': 1, 'ZPY': 1, 'REL': 1, 'IZX': 1, 'IZY': 1,
+                 'ABS': 2, 'ABX': 2, 'ABY': 2, 'IND': 2}
+
+OPERATIONS = {
+    'ADC': '''
+        T = ADC[(P & 0x01) << 16 | A << 8 | V]
+        P = (P & 0xBE) | (T >> 8)
+        A = T & 0xFF
+        R = A
+    ''',
+    'SBC': '''
+        T = SBC[(P & 0x01) << 16 | A << 8 | V]
+        P = (P & 0xBE) | (T >> 8)
+        A = T & 0xFF
+        R = A
+    ''',
+    'AND': _logic('&'),
+    'EOR': _logic('^'),
+    'ORA': _logic('|'),
+    'ASL': '''
+        T = V << 1
+        P = (P & 0xFE) | (T >> 8)
+        T &= 0xFF
+        R = T
+    ''',
+    'LSR': '''
+        T = V >> 1
+        P = (P & 0xFE) | (V & 0x01)
+        R = T
+    ''',
+    'ROL': '''
+        T = (V << 1) | (P & 0x01)
+        P = (P & 0xFE) | (T >> 8)
+        T &= 0xFF
+        R = T
+    ''',
+    'ROR': '''
+        T = ((P & 0x01) << 7) | (V >> 1)
+        P = (P & 0xFE) | (V & 0x01)
+        R = T
+    ''',
+    'BCC': _branch('not P & 0x01'),
+    'BCS': _branch('P & 0x01'),
+    'BEQ': _branch('not R & 0xFF'),
+    'BNE': _branch('R & 0xFF'),
+    'BMI': _branch('R & 0x180'),
+    'BPL': _branch('not R & 0x180'),
+    'BVC': _branch('not P & 0x40'),
+    'BVS': _branch('P & 0x40'),
+    'BIT': '''
+        P = (P & 0xBF) | (V & 0x40)
+        R = (V & 0x80) | 0x01 if A & V else (V & 0x80) << 1
+    ''',
+    'BRK': '''
+        PC = (PC + 1) & 0xFFFF
+        P |= 0x04
+    ''' + _PUSH.format('(PC >> 8) & 0xFF') + _PUSH.format('PC & 0xFF') + _PUSH.format('P | NZ[R] | 0x10') + '''
+        P &= 0xEF
+        PC = read(0xFFFE) | (read(0xFFFF) << 8)
+    ''',
+    'CLC': 'P &= 0xFE',
+    'CLD': 'P &= 0xF7',
+    'CLI': 'P &= 0xFB',
+    'CLV': 'P &= 0xBF',
+    'SEC': 'P |= 0x01',
+    'SED': 'P |= 0x08',
+    'SEI': 'P |= 0x04',
+    'CMP': _compare('A'),
+    'CPX': _compare('X'),
+    'CPY': _compare('Y'),
+    'DEC': _memory('-'),
+    'INC': _memory('+'),
+    'DEX': _step('X', '-'),
+    'DEY': _step('Y', '-'),
+    'INX': _step('X', '+'),
+    'INY': _step('Y', '+'),
+    'JMP': 'PC = ADDR',
+    'JSR': '''
+        PC = (PC - 1) & 0xFFFF
+    ''' + _PUSH.format('(PC >> 8) & 0xFF') + _PUSH.format('PC & 0xFF') + '''
+        PC = ADDR
+    ''',
+    'LDA': _load('A'),
+    'LDX': _load('X'),
+    'LDY': _load('Y'),
+    'NOP': '',
+    'PHA': _PUSH.format('A'),
+    'PHP': _PUSH.format('P | NZ[R] | 0x30') + '''
+        P &= 0xEF
+    ''',
+    'PLA': _PULL.format('A') + '''
+        R = A
+    ''',
+    'PLP': _PULL.format('T') + '''
+        P = (T & 0x7D) | 0x20
+        R = NZ_RESULT[T]
+    ''',
+    'RTI': _PULL.format('T') + '''
+        P = (T & 0x4D) | 0x20
+        R = NZ_RESULT[T]
+    ''' + _PULL.format('PC') + _PULL.format('HI') + '''
+        PC |= HI << 8
+    ''',
+    'RTS': _PULL.format('PC') + _PULL.format('HI') + '''
+        PC = ((PC | (HI << 8)) + 1) & 0xFFFF
+    ''',
+    'STA': 'write(ADDR, A)',
+    'STX': 'write(ADDR, X)',
+    'STY': 'write(ADDR, Y)',
+    'TAX': _transfer('X', 'A'),
+    'TAY': _transfer('Y', 'A'),
+    'TSX': _transfer('X', 'SP'),
+    'TXA': _transfer('A', 'X'),
+    'TYA': _transfer('A', 'Y'),
+    'TXS': 'SP = X',
+    'XXX': '',
+}
+
+REGISTERS = (('A', 'a'), ('X', 'x'), ('Y', 'y'), ('SP', 'stkp'), ('PC', 'pc'))
+
+
+def _lines(template: str) -> List[str]:
+    lines = [line for line in template.split('\n') if line.strip()]
+    if not lines:
+        return []
+    indent = min(len(line) - len(line.lstrip()) for line in lines)
+    return [line[indent:] for line in lines]
+
+
+def _bake(lines: List[str], pc: int, operand: int) -> List[str]:
+    # address mode lines with the operand of an instruction at a known pc filled in
+    baked = []
+    for line in lines:
+        if line.startswith('PC = (PC + '):
+            continue
+        line = line.replace('read((PC + 1) & 0xFFFF)', f'0x{operand >> 8:02X}')
+        line = line.replace('read(PC)', f'0x{operand & 0xFF:02X}')
+        baked.append(line.replace('ADDR = PC', f'ADDR = 0x{(pc + 1) & 0xFFFF:04X}'))
+    return baked
+
+
+def instruction_body(opcode: int, instructions: list, pc: int = None, operand: int = 0) -> Tuple[List[str], str]:
+    # source lines of one instruction and the expression of its extra cycles,
+    # with the operand baked in when the address of the instruction is given
+    _, op, mode, _ = instructions[opcode]
+    lines = _lines(ADDRESS_MODES[mode])
+    if pc is not None:
+        lines = [] if mode == 'IMM' and op in FETCHES else _bake(lines, pc, operand)
+    if op in FETCHES:
+        if mode == 'IMP':
+            lines.append('V = A')
+        elif mode == 'IMM' and pc is not None:
+            lines.append(f'V = 0x{operand:02X}')
+        else:
+            lines.append('V = read(ADDR)')
+    if pc is not None and _uses('PC', OPERATIONS[op]):
+        lines.append(f'PC = 0x{(pc + 1 + OPERAND_BYTES[mode]) & 0xFFFF:04X}')
+    lines += _lines(OPERATIONS[op])
+    if op in SHIFTS:
+        lines.append('A = T' if mode == 'IMP' else 'write(ADDR, T)')
+    page = 'PAGE' in ADDRESS_MODES[mode] and (
+        op in PAGE_SENSITIVE or (op == 'NOP' and opcode in PAGE_SENSITIVE_NOPS))
+    extra = [name for name, used in (('EXTRA', 'EXTRA' in OPERATIONS[op]), ('PAGE', page)) if used]
+    return lines, ' + '.join(extra) or '0'
+
+
+def _uses(name: str, source: str) -> bool:
+    return re.search(rf'\b{name}\b', source) is not None
+
+
+def _assigns(name: str, lines: List[str]) -> bool:
+    pattern = re.compile(rf'^\s*{name}\s*(?:[-+|&^]|<<|>>)?=(?!=)')
+    return any(pattern.match(line) for line in lines)
+
+
+def wrap(name: str, lines: List[str], result: str) -> str:
+    # turn an instruction body into `def name(cpu)` loading and storing registers
+    source = '\n'.join(lines) + '\n' + result
+    head = []
+    if _uses('read', source):
+        head.append('read = cpu.read')
+    if _uses('write', source):
+        head.append('write = cpu.write')
+    for local, attr in REGISTERS:
+        if _uses(local, source):
+            head.append(f'{local} = cpu.{attr}')
+    if _uses('P', source):
+        head.append('P = cpu.flags')
+    if _uses('R', source):
+        head.append('R = cpu.nz')
+    if _uses('EXTRA', source):
+        head.append('EXTRA = 0')
+    tail = [f'cpu.{attr} = {local}' for local, attr in REGISTERS if _assigns(local, lines)]
+    if _assigns('P', lines):
+        tail.append('cpu.flags = P')
+    if _assigns('R', lines):
+        tail.append('cpu.nz = R')
+    tail.append(f'return {result}')
+    body = '\n'.join('    ' + line for line in head + lines + tail)
+    return f'def {name}(cpu):\n{body}\n'
+
+
+def compile_functions(sources: List[str], names: List[str]) -> List[Callable]:
+    namespace = {'NZ': NZ_FLAGS, 'NZ_RESULT': NZ_RESULT, 'ADC': ADC_TABLE, 'SBC': SBC_TABLE, 'CMP': CMP_TABLE}
+    exec(compile('\n'.join(sources), '<pynes.codegen>', 'exec'), namespace)
+    return [namespace[name] for name in names]
+
+
+@lru_cache(maxsize=None)
+def _fused_handlers(instructions: tuple) -> tuple:
+    names = [f'op_{opcode:02X}' for opcode in range(256)]
+    sources = [wrap(name, *instruction_body(opcode, instructions)) for opcode, name in enumerate(names)]
+    return tuple(compile_functions(sources, names))
+
+
+def fused_handlers(instructions: list) -> tuple:
+    return _fused_handlers(tuple(instructions))
+
+
+def compile_block(code: List[Tuple[int, int, int]], instructions: list) -> Tuple[Callable, int]:
+    # one function running the (pc, opcode, operand) instructions of a basic
+    # block and returning the cycles taken, and the most cycles it can take
+    lines = []
+    cycles = most = 0
+    for pc, opcode, operand in code:
+        body, extra = instruction_body(opcode, instructions, pc, operand)
+        lines += body
+        if 'PAGE' in extra:
+            lines.append('EXTRA += PAGE')
+            most += 1
+        cycles += instructions[opcode][3]
+    _, op, mode, _ = instructions[code[-1][1]]
+    if op not in BLOCK_ENDS:
+        lines.append(f'PC = 0x{(pc + 1 + OPERAND_BYTES[mode]) & 0xFFFF:04X}')
+    elif mode == 'REL':
+        most += 2
+    name = f'block_{code[0][0]:04X}'
+    result = f'{cycles} + EXTRA' if _uses('EXTRA', '\n'.join(lines)) else str(cycles)
+    return compile_functions([wrap(name, lines, result)], [name])[0], cycles + most
@@ -1,8 +1,10 @@
 from typing import Any
 from easydict import EasyDict
 from loguru import logger
-from pynes.bits import uint8, uint16, u8, u16
+from pynes.bits import uint8, uint16, u8, u16, assert_u8, assert_u16, checked, is_checked
 from pynes.device import Device
+from pynes.codegen import fused_handlers, compile_block, FETCHES, WRITES, BLOCK_ENDS, OPERAND_BYTES
+from pynes.flags import NZ_FLAGS, NZ_RESULT, ADC_TABLE, SBC_TABLE, CMP_TABLE
 
 
 FLAGS6502 = EasyDict(
@@ -40,9 +42,18 @@ OPERATE = 1
 ADDRESS_MODE = 2
 CYCLES = 3
 
+# the most instructions translated into one basic block
+BLOCK_INSTRUCTIONS = 32
+
+cvt_type = lambda x:tuple(i if p != 3 else int(i) for p, i in enumerate(x))
+INSTRUCTIONS = [cvt_type(i.split(',')) for i in lookup.split()]
+
 
 class CPU(Device):
-    def __init__(self, debug: bool = False, name: str = '') -> None:
+    STATE = ('a', 'x', 'y', 'stkp', 'pc', 'flags', 'nz', 'fetched', 'temp', 'addr_abs', 'addr_rel', 'optcode',
+             'cycles', 'clock_count', 'implied')
+
+    def __init__(self, debug: bool = False, name: str = '', fused: bool = False, blocks: bool = False) -> None:
         super().__init__(name=name)
 
         # actrual registers
@@ -51,7 +62,10 @@ class CPU(Device):
         self.y = uint8()
         self.stkp = uint8()
         self.pc = uint16()
-        self.status = uint8()
+        # status is split into the flags other than N and Z, and the last result
+        # N and Z are derived from, see pynes.flags
+        self.flags = FLAGS6502.U
+        self.nz = 1
 
         # virtual variables
         self.fetched = uint8()
@@ -64,8 +78,21 @@ class CPU(Device):
 
         self.read = None
         self.write = None
-        cvt_type = lambda x:tuple(i if p != 3 else int(i) for p, i in enumerate(x))
-        self.lookup = [cvt_type(i.split(',')) for i in lookup.split()]
+        self.lookup = INSTRUCTIONS
+        # (address mode, operation, cycles, implied) per opcode, bound once
+        self.dispatch = [(getattr(self, mode), getattr(self, op), cycles, mode == 'IMP')
+                         for _, op, mode, cycles in self.lookup]
+        self.implied = False
+        # one generated function per opcode with mode and operation inlined
+        self.fused = fused
+        self.handlers = fused_handlers(self.lookup) if fused else None
+        self.execute = self.execute_fused if fused else self.execute_interpreted
+        if is_checked():
+            self.execute = checked(self.execute, result=self.check_registers)
+        # translated basic blocks by (pc, offset of its page in the bus page
+        # table), and the blocks built from each RAM byte
+        self.blocks = {} if blocks else None
+        self.ram_code = {}
 
         self.debug = debug
         self.bus = None
@@ -79,7 +106,7 @@ class CPU(Device):
         addr_abs = 0xFFFC
         lo = self.read(addr_abs)
         hi = self.read(addr_abs + 1)
-        self.pc = u16(hi << 8 | lo)
+        self.pc = (hi << 8 | lo) & 0xFFFF
         self.a = uint8()
         self.x = uint8()
         self.y = uint8()
@@ -90,6 +117,15 @@ class CPU(Device):
         self.fetched = uint8()
         self.cycles = 8
 
+    @property
+    def status(self) -> int:
+        return self.flags | NZ_FLAGS[self.nz]
+
+    @status.setter
+    def status(self, value: int) -> None:
+        self.flags = (value & 0x7D) | FLAGS6502.U
+        self.nz = NZ_RESULT[value]
+
     def setFlag(self, flag: Any, val: int) -> None:
         if isinstance(flag, str):
             flag = FLAGS6502[flag]
@@ -110,36 +146,36 @@ class CPU(Device):
 
     def IMM(self) -> int:
         self.addr_abs = self.pc
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         return 0
 
     def ZP0(self) -> int:
         self.addr_abs = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         return 0
 
     def ZPX(self) -> int:
-        self.addr_abs = u8(self.read(self.pc) + self.x)
-        self.pc = u16(self.pc + 1)
+        self.addr_abs = (self.read(self.pc) + self.x) & 0xFF
+        self.pc = (self.pc + 1) & 0xFFFF
         return 0
 
     def ZPY(self) -> int:
-        self.addr_abs = u8(self.read(self.pc) + self.y)
-        self.pc = u16(self.pc + 1)
+        self.addr_abs = (self.read(self.pc) + self.y) & 0xFF
+        self.pc = (self.pc + 1) & 0xFFFF
         return 0
 
     def REL(self) -> int:
         self.addr_rel = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         if self.addr_rel & 0x80:
             self.addr_rel |= 0xFF00
         return 0
 
     def ABS(self) -> int:
         lo = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         hi = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         self.addr_abs = (hi << 8) | lo
         return 0
 
@@ -161,10 +197,10 @@ class CPU(Device):
 
     def IND(self) -> int:
         lo = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         hi = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
-        ptr = u16(hi << 8 | lo)
+        self.pc = (self.pc + 1) & 0xFFFF
+        ptr = (hi << 8 | lo) & 0xFFFF
         if lo == 0xff:
             self.addr_abs = (self.read(ptr & 0xff00) << 8) | self.read(ptr)
         else:
@@ -173,7 +209,7 @@ class CPU(Device):
 
     def IZX(self) -> int:
         t = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         lo = self.read((t + self.x) & 0x00FF)
         hi = self.read((t + self.x + 1) & 0x00FF)
         self.addr_abs = (hi << 8) | lo
@@ -181,7 +217,7 @@ class CPU(Device):
 
     def IZY(self) -> int:
         t = self.read(self.pc)
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         lo = self.read(t & 0x00FF)
         hi = self.read((t + 1) & 0x00FF)
         self.addr_abs = (hi << 8) | lo
@@ -191,47 +227,36 @@ class CPU(Device):
         return 0
 
     def fetch(self) -> int:
-        if self.lookup[self.optcode][ADDRESS_MODE] != 'IMP':
+        if not self.implied:
             self.fetched = self.read(self.addr_abs)
         return self.fetched
 
     def ADC(self) -> int:
         self.fetch()
-        self.temp = u16(self.a + self.fetched + self.getFlag('C'))
-        self.setFlag('C', self.temp > 255)
-        self.setFlag('Z', self.temp & 0x00FF == 0)
-        self.setFlag('V', (~(self.a ^ self.fetched) &
-                    (self.a ^ self.temp)) & 0x0080)
-        self.setFlag('N', self.temp & 0x80)
-        self.a = u8(self.temp)
+        self.temp = ADC_TABLE[(self.flags & 0x01) << 16 | self.a << 8 | self.fetched]
+        self.flags = (self.flags & 0xBE) | (self.temp >> 8)
+        self.a = self.nz = self.temp & 0xFF
         return 1
 
     def SBC(self) -> int:
         self.fetch()
-        val = self.fetched ^ 0x00FF
-        self.temp = u16(self.a) + val + self.getFlag('C')
-        self.setFlag('C', self.temp > 255)
-        self.setFlag('Z', self.temp & 0x00FF == 0)
-        self.setFlag('V', (~(self.a ^ self.fetched) &
-                    (self.a ^ self.temp)) & 0x0080)
-        self.setFlag('N', self.temp & 0x80)
-        self.a = u8(self.temp)
+        self.temp = SBC_TABLE[(self.flags & 0x01) << 16 | self.a << 8 | self.fetched]
+        self.flags = (self.flags & 0xBE) | (self.temp >> 8)
+        self.a = self.nz = self.temp & 0xFF
         return 1
 
     def AND(self) -> int:
         self.fetch()
         self.a &= self.fetched
-        self.setFlag('Z', self.a == 0x00)
-        self.setFlag('N', self.a & 0x80)
+        self.nz = self.a
         return 1
 
     def ASL(self) -> int:
         self.fetch()
-        self.temp = u16(self.fetched << 1)
-        self.setFlag('C', self.temp & 0xFF00 > 0)
-        self.setFlag('Z', self.temp & 0x00FF == 0x00)
-        self.setFlag('N', self.temp & 0x80)
-        if self.lookup[self.optcode][ADDRESS_MODE] == 'IMP':
+        self.temp = self.fetched << 1
+        self.flags = (self.flags & 0xFE) | (self.temp >> 8)
+        self.nz = self.temp & 0xFF
+        if self.implied:
             self.a = self.temp & 0x00FF
         else:
             self.write(self.addr_abs, self.temp & 0x00FF)
@@ -242,27 +267,27 @@ class CPU(Device):
 
 
     def BCC(self) -> int:
-        if self.getFlag("C") == 0:
+        if not self.flags & 0x01:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BCS(self) -> int:
-        if self.getFlag("C") == 1:
+        if self.flags & 0x01:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BEQ(self) -> int:
-        if self.getFlag("Z") == 1:
+        if not self.nz & 0xFF:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
@@ -271,155 +296,143 @@ class CPU(Device):
     def BIT(self) -> int:
         self.fetch()
         self.temp = self.a & self.fetched
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x00)
-        self.setFlag("N", self.fetched & (1 << 7))
-        self.setFlag("V", self.fetched & (1 << 6))
+        self.flags = (self.flags & 0xBF) | (self.fetched & 0x40)
+        self.nz = (self.fetched & 0x80) | 0x01 if self.temp else (self.fetched & 0x80) << 1
         return 0
 
     def BMI(self) -> int:
-        if self.getFlag("N") == 1:
+        if self.nz & 0x180:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BNE(self) -> int:
-        if self.getFlag("Z") == 0:
+        if self.nz & 0xFF:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BPL(self) -> int:
-        if self.getFlag("N") == 0:
+        if not self.nz & 0x180:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BRK(self) -> int:
-        self.pc = u16(self.pc + 1)
-        self.setFlag("I", 1)
+        self.pc = (self.pc + 1) & 0xFFFF
+        self.flags |= 0x04
         self.write(0x0100 + self.stkp, (self.pc >> 8) & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
         self.write(0x0100 + self.stkp, self.pc & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
-        self.setFlag("B", 1)
-        self.write(0x0100 + self.stkp, self.status)
-        self.stkp = u8(self.stkp - 1)
-        self.setFlag("B", 0)
+        self.stkp = (self.stkp - 1) & 0xFF
+        self.write(0x0100 + self.stkp, self.status | FLAGS6502.B)
+        self.stkp = (self.stkp - 1) & 0xFF
+        self.flags &= 0xEF
         self.pc = self.read(0xFFFE) | (self.read(0xFFFF) << 8)
         return 0
 
     def BVC(self) -> int:
-        if self.getFlag("V") == 0:
+        if not self.flags & 0x40:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def BVS(self) -> int:
-        if self.getFlag("V") == 1:
+        if self.flags & 0x40:
             self.cycles += 1
-            self.addr_abs = u16(self.pc + self.addr_rel)
+            self.addr_abs = (self.pc + self.addr_rel) & 0xFFFF
             if (self.addr_abs & 0xFF00) != (self.pc & 0xFF00):
                 self.cycles += 1
             self.pc = self.addr_abs
         return 0
 
     def CLC(self) -> int:
-        self.setFlag("C", False)
+        self.flags &= 0xFE
         return 0
 
     def CLD(self) -> int:
-        self.setFlag("D", False)
+        self.flags &= 0xF7
         return 0
 
     def CLI(self) -> int:
-        self.setFlag('I', False)
+        self.flags &= 0xFB
         return 0
 
     def CLV(self) -> int:
-        self.setFlag('V', False)
+        self.flags &= 0xBF
         return 0
 
     def CMP(self) -> int:
         self.fetch()
-        self.temp = u16(self.a - self.fetched)
-        self.setFlag("C", self.a >= self.fetched)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
+        self.temp = CMP_TABLE[self.a << 8 | self.fetched]
+        self.flags = (self.flags & 0xFE) | (self.temp >> 8)
+        self.nz = self.temp & 0xFF
         return 1
 
     def CPX(self) -> int:
         self.fetch()
-        self.temp = u16(self.x - self.fetched)
-        self.setFlag("C", self.x >= self.fetched)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
+        self.temp = CMP_TABLE[self.x << 8 | self.fetched]
+        self.flags = (self.flags & 0xFE) | (self.temp >> 8)
+        self.nz = self.temp & 0xFF
         return 0
 
     def CPY(self) -> int:
         self.fetch()
-        self.temp = u16(self.y - self.fetched)
-        self.setFlag("C", self.y >= self.fetched)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
+        self.temp = CMP_TABLE[self.y << 8 | self.fetched]
+        self.flags = (self.flags & 0xFE) | (self.temp >> 8)
+        self.nz = self.temp & 0xFF
         return 0
 
     def DEC(self) -> int:
         self.fetch()
         self.temp = self.fetched - 1
         self.write(self.addr_abs, self.temp & 0x00FF)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
+        self.nz = self.temp & 0xFF
         return 0
 
     def DEX(self) -> int:
-        self.x = u8(self.x - 1)
-        self.setFlag("Z", self.x == 0x00)
-        self.setFlag("N", self.x & 0x80)
+        self.x = (self.x - 1) & 0xFF
+        self.nz = self.x
         return 0
 
     def DEY(self) -> int:
-        self.y = u8(self.y - 1)
-        self.setFlag("Z", self.y == 0x00)
-        self.setFlag("N", self.y & 0x80)
+        self.y = (self.y - 1) & 0xFF
+        self.nz = self.y
         return 0
 
     def EOR(self) -> int:
         self.fetch()
         self.a = self.a ^ self.fetched
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 1
 
     def INC(self) -> int:
         self.fetch()
         self.temp = self.fetched + 1
         self.write(self.addr_abs, self.temp & 0x00FF)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
+        self.nz = self.temp & 0xFF
         return 0
 
     def INX(self) -> int:
-        self.x = u8(self.x + 1)
-        self.setFlag("Z", self.x == 0x00)
-        self.setFlag("N", self.x & 0x80)
+        self.x = (self.x + 1) & 0xFF
+        self.nz = self.x
         return 0
 
     def INY(self) -> int:
-        self.y = u8(self.y + 1)
-        self.setFlag("Z", self.y == 0x00)
-        self.setFlag("N", self.y & 0x80)
+        self.y = (self.y + 1) & 0xFF
+        self.nz = self.y
         return 0
 
     def JMP(self) -> int:
@@ -430,9 +443,9 @@ class CPU(Device):
         self.pc -= 1
 
         self.write(0x0100 + self.stkp, (self.pc >> 8) & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
         self.write(0x0100 + self.stkp, self.pc & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
 
         self.pc = self.addr_abs
         return 0
@@ -440,31 +453,27 @@ class CPU(Device):
     def LDA(self) -> int:
         self.fetch()
         self.a = self.fetched
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 1
 
     def LDX(self) -> int:
         self.fetch()
         self.x = self.fetched
-        self.setFlag("Z", self.x == 0x00)
-        self.setFlag("N", self.x & 0x80)
+        self.nz = self.x
         return 1
 
     def LDY(self) -> int:
         self.fetch()
         self.y = self.fetched
-        self.setFlag("Z", self.y == 0x00)
-        self.setFlag("N", self.y & 0x80)
+        self.nz = self.y
         return 1
 
     def LSR(self) -> int:
         self.fetch()
-        self.setFlag("C", self.fetched & 0x0001)
         self.temp = self.fetched >> 1
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
-        if self.lookup[self.optcode][ADDRESS_MODE] == 'IMP':
+        self.flags = (self.flags & 0xFE) | (self.fetched & 0x01)
+        self.nz = self.temp
+        if self.implied:
             self.a = self.temp & 0x00FF
         else:
             self.write(self.addr_abs, self.temp & 0x00FF)
@@ -478,42 +487,37 @@ class CPU(Device):
     def ORA(self) -> int:
         self.fetch()
         self.a = self.a | self.fetched
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 1
 
     def PHA(self) -> int:
         self.write(0x0100 + self.stkp, self.a)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
         return 0
 
     def PHP(self) -> int:
         self.write(0x0100 + self.stkp, self.status | FLAGS6502.B | FLAGS6502.U)
-        self.setFlag("B", 0)
-        self.setFlag("U", 0)
-        self.stkp = u8(self.stkp - 1)
+        self.flags &= 0xEF
+        self.stkp = (self.stkp - 1) & 0xFF
         return 0
 
     def PLA(self) -> int:
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
         self.a = self.read(0x0100 + self.stkp)
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 0
 
     def PLP(self) -> int:
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
         self.status = self.read(0x0100 + self.stkp)
-        self.setFlag("U", 1)
         return 0
 
     def ROL(self) -> int:
         self.fetch()
-        self.temp = u16(self.fetched << 1) | self.getFlag("C")
-        self.setFlag("C", self.temp & 0xFF00)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x0000)
-        self.setFlag("N", self.temp & 0x0080)
-        if self.lookup[self.optcode][ADDRESS_MODE] == 'IMP':
+        self.temp = (self.fetched << 1) | (self.flags & 0x01)
+        self.flags = (self.flags & 0xFE) | (self.temp >> 8)
+        self.nz = self.temp & 0xFF
+        if self.implied:
             self.a = self.temp & 0x00FF
         else:
             self.write(self.addr_abs, self.temp & 0x00FF)
@@ -521,45 +525,42 @@ class CPU(Device):
 
     def ROR(self) -> int:
         self.fetch()
-        self.temp = u16(self.getFlag("C") << 7) | (self.fetched >> 1)
-        self.setFlag("C", self.fetched & 0x01)
-        self.setFlag("Z", (self.temp & 0x00FF) == 0x00)
-        self.setFlag("N", self.temp & 0x0080)
-        if self.lookup[self.optcode][ADDRESS_MODE] == 'IMP':
+        self.temp = ((self.flags & 0x01) << 7) | (self.fetched >> 1)
+        self.flags = (self.flags & 0xFE) | (self.fetched & 0x01)
+        self.nz = self.temp
+        if self.implied:
             self.a = self.temp & 0x00FF
         else:
             self.write(self.addr_abs, self.temp & 0x00FF)
         return 0
 
     def RTI(self) -> int:
-        self.stkp = u8(self.stkp + 1)
-        self.status = self.read(0x0100 + self.stkp)
-        self.status &= ~FLAGS6502.B
-        self.status &= ~FLAGS6502.U
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
+        self.status = self.read(0x0100 + self.stkp) & ~FLAGS6502.B
+        self.stkp = (self.stkp + 1) & 0xFF
         self.pc = self.read(0x0100 + self.stkp)
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
         self.pc |= self.read(0x0100 + self.stkp) << 8
         return 0
 
     def RTS(self) -> int:
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
         self.pc = self.read(0x0100 + self.stkp)
-        self.stkp = u8(self.stkp + 1)
+        self.stkp = (self.stkp + 1) & 0xFF
         self.pc |= self.read(0x0100 + self.stkp) << 8
-        self.pc = u16(self.pc + 1)
+        self.pc = (self.pc + 1) & 0xFFFF
         return 0
 
     def SEC(self) -> int:
-        self.setFlag("C", True)
+        self.flags |= 0x01
         return 0
 
     def SED(self) -> int:
-        self.setFlag("D", True)
+        self.flags |= 0x08
         return 0
 
     def SEI(self) -> int:
-        self.setFlag('I', True)
+        self.flags |= 0x04
         return 0
 
     def STA(self) -> int:
@@ -576,26 +577,22 @@ class CPU(Device):
 
     def TAX(self) -> int:
         self.x = self.a
-        self.setFlag("Z", self.x == 0x00)
-        self.setFlag("N", self.x & 0x80)
+        self.nz = self.x
         return 0
 
     def TAY(self) -> int:
         self.y = self.a
-        self.setFlag("Z", self.y == 0x00)
-        self.setFlag("N", self.y & 0x80)
+        self.nz = self.y
         return 0
 
     def TSX(self) -> int:
         self.x = self.stkp
-        self.setFlag("Z", self.x == 0x00)
-        self.setFlag("N", self.x & 0x80)
+        self.nz = self.x
         return 0
 
     def TXA(self) -> int:
         self.a = self.x
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 0
 
     def TXS(self) -> int:
@@ -604,24 +601,21 @@ class CPU(Device):
 
     def TYA(self) -> int:
         self.a = self.y
-        self.setFlag("Z", self.a == 0x00)
-        self.setFlag("N", self.a & 0x80)
+        self.nz = self.a
         return 0
 
     def XXX(self) -> int:
         return 0
 
     def irq(self) -> None:
-        if self.getFlag('I') == 0:
+        if not self.flags & 0x04:
             self.write(0x0100 + self.stkp, (self.pc >> 8) & 0x00FF)
-            self.stkp = u8(self.stkp - 1)
+            self.stkp = (self.stkp - 1) & 0xFF
             self.write(0x0100 + self.stkp, self.pc & 0x00FF)
-            self.stkp = u8(self.stkp - 1)
-            self.setFlag('B', 0)
-            self.setFlag('U', 1)
-            self.setFlag('I', 1)
+            self.stkp = (self.stkp - 1) & 0xFF
+            self.flags = (self.flags & 0xEF) | 0x04
             self.write(0x0100 + self.stkp, self.status)
-            self.stkp = u8(self.stkp - 1)
+            self.stkp = (self.stkp - 1) & 0xFF
             self.addr_abs = 0xFFFE
             lo = self.read(self.addr_abs + 0)
             hi = self.read(self.addr_abs + 1)
@@ -630,38 +624,130 @@ class CPU(Device):
 
     def nmi(self) -> None:
         self.write(0x0100 + self.stkp, (self.pc >> 8) & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
         self.write(0x0100 + self.stkp, self.pc & 0x00FF)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
 
-        self.setFlag('B', 0)
-        self.setFlag('U', 1)
-        self.setFlag('I', 1)
+        self.flags = (self.flags & 0xEF) | 0x04
         self.write(0x0100 + self.stkp, self.status)
-        self.stkp = u8(self.stkp - 1)
+        self.stkp = (self.stkp - 1) & 0xFF
 
         self.addr_abs = 0xFFFA
         lo = self.read(self.addr_abs + 0)
         hi = self.read(self.addr_abs + 1)
-        self.pc = u16(hi << 8) | lo
+        self.pc = ((hi << 8) & 0xFFFF) | lo
 
         self.cycles = 8
 
+    def execute_interpreted(self) -> int:
+        self.optcode = self.read(self.pc)
+        self.pc = (self.pc + 1) & 0xFFFF
+        addr_mode, operate, self.cycles, self.implied = self.dispatch[self.optcode]
+        add_cycle1 = addr_mode()
+        add_cycle2 = operate()
+        if self.debug:
+            logger.debug(f"Ins: {self.lookup[self.optcode][OPERATE]} {self.lookup[self.optcode][ADDRESS_MODE]}")
+            logger.debug(self)
+        self.cycles += add_cycle1 & add_cycle2
+        return self.cycles
+
+    def execute_fused(self) -> int:
+        self.optcode = self.read(self.pc)
+        self.pc = (self.pc + 1) & 0xFFFF
+        self.cycles = self.lookup[self.optcode][CYCLES] + self.handlers[self.optcode](self)
+        if self.debug:
+            logger.debug(f"Ins: {self.lookup[self.optcode][OPERATE]} {self.lookup[self.optcode][ADDRESS_MODE]}")
+            logger.debug(self)
+        return self.cycles
+
+    def check_registers(self, cycles: int) -> None:
+        for register in (self.a, self.x, self.y, self.stkp, self.status):
+            assert_u8(register)
+        assert_u16(self.pc)
+
+    def step(self) -> int:
+        cycles = self.cycles or self.execute()
+        self.clock_count += cycles
+        self.cycles = 0
+        return cycles
+
+    def step_block(self, budget: int) -> int:
+        # like step(), but runs the whole basic block at pc when it cannot
+        # take more than budget cycles
+        if self.cycles or self.debug:
+            return self.step()
+        key = (self.pc, self.bus.read_pages[self.pc >> 8][1])
+        block = self.blocks.get(key)
+        if block is None:
+            block = self.blocks[key] = self.translate(key)
+        run, most = block
+        if run is None or most > budget:
+            return self.step()
+        cycles = run(self)
+        self.clock_count += cycles
+        return cycles
+
+    def translate(self, key: tuple) -> tuple:
+        # collect straight-line code from the page at pc up to a branch or
+        # jump, stopping before any instruction that might touch more than
+        # RAM or ROM unless it comes first, as only then does it run on time
+        pc = key[0]
+        memory, offset = self.bus.read_pages[pc >> 8]
+        if memory is None:
+            return None, 0
+        code = []
+        addr = pc
+        while len(code) < BLOCK_INSTRUCTIONS and addr >> 8 == pc >> 8:
+            opcode = memory[offset | (addr & 0xFF)]
+            _, op, mode, _ = self.lookup[opcode]
+            size = 1 + OPERAND_BYTES[mode]
+            if (addr & 0xFF) + size > 0x100:
+                break
+            operand = 0
+            for i in range(size - 1, 0, -1):
+                operand = operand << 8 | memory[offset | ((addr + i) & 0xFF)]
+            if code and self.touches_io(op, mode, operand):
+                break
+            code.append((addr, opcode, operand))
+            addr += size
+            if op in BLOCK_ENDS:
+                break
+        if not code:
+            return None, 0
+        if pc < 0x2000:
+            for byte in range(pc, addr):
+                self.ram_code.setdefault(byte & 0x07FF, []).append(key)
+            self.bus.watch_ram_code()
+        return compile_block(code, self.lookup)
+
+    def touches_io(self, op: str, mode: str, operand: int) -> bool:
+        if mode in ('IMP', 'IMM', 'REL', 'ZP0', 'ZPX', 'ZPY'):
+            return False
+        if mode in ('IZX', 'IZY'):
+            return True
+        writes = op in WRITES
+        if not writes and op not in FETCHES and mode != 'IND':
+            return False
+        last = operand + (0xFF if mode in ('ABX', 'ABY') else 0x01 if mode == 'IND' else 0x00)
+        if last > 0xFFFF:
+            return True
+        for page in (operand >> 8, last >> 8):
+            if page >= 0x20 and (writes or self.bus.read_pages[page][0] is None):
+                return True
+        return False
+
+    def flush_blocks(self) -> None:
+        if self.blocks:
+            self.blocks.clear()
+        self.ram_code.clear()
+
+    def drop_ram_code(self, offset: int) -> None:
+        for key in self.ram_code.pop(offset, ()):
+            self.blocks.pop(key, None)
+
     def clock(self) -> None:
         if self.cycles == 0:
-            self.optcode = self.read(self.pc)
-            self.setFlag('U', True)
-            self.pc = u16(self.pc + 1)
-            self.cycles = self.lookup[self.optcode][CYCLES]
-            add_cycle1 = getattr(
-                self, self.lookup[self.optcode][ADDRESS_MODE])()
-            add_cycle2 = getattr(self, self.lookup[self.optcode][OPERATE])()
-            if self.debug:
-                pass
-                logger.debug(f"Ins: {self.lookup[self.optcode][OPERATE]} {self.lookup[self.optcode][ADDRESS_MODE]}")
-                logger.debug(self)
-            self.cycles += add_cycle1 & add_cycle2
-            self.setFlag('U', True)
+            self.cycles = self.execute()
         self.clock_count += 1
         self.cycles -= 1
 
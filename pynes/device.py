@@ -1,12 +1,29 @@
 from abc import ABC
-from pynes.bits import t16, t8, u16, u8
+from struct import Struct
+from typing import Callable, Dict, Optional, Tuple
+from pynes.bits import t16, t8, u16, u8, checked, is_checked
 
 _format_16 = {'pc', 'addr_abs', 'addr_rel', 'stkp'}
-_format_8 = {'a', 'x', 'y', 'status', 'fetched', 'temp'}
+_format_8 = {'a', 'x', 'y', 'status', 'flags', 'fetched', 'temp'}
 class Device(ABC):
+    # method name -> (argument checks, result check) used in checked builds
+    CHECKS: Dict[str, Tuple[Tuple[Callable], Optional[Callable]]] = {}
+    # attributes a save state holds: STATE as 64-bit integers, then the bytes
+    # of each STATE_BUFFERS buffer, see pack_state()
+    STATE: Tuple[str, ...] = ()
+    STATE_BUFFERS: Tuple[str, ...] = ()
+
     def __init__(self, name:str='') -> None:
         super().__init__()
         self.name = name if name else f'{self.__class__.__name__}@{id(self)}'
+        self.install_checks()
+
+    def install_checks(self, *names: str) -> None:
+        if not is_checked():
+            return
+        for attr_name in names or self.CHECKS:
+            args, result = self.CHECKS[attr_name]
+            setattr(self, attr_name, checked(getattr(self, attr_name), args, result))
     def __str__(self, exist_devices=None) -> str:
         r = []
         for attr_name, val in self.__dict__.items():
@@ -31,6 +48,34 @@ class Device(ABC):
         msg = ", ".join([f'{i}={j}' for i, j in msg])
         return f'{self.name}({msg})'
 
+    def state_buffers(self) -> list:
+        return [buffer for buffer in map(self.__dict__.get, self.STATE_BUFFERS) if buffer is not None]
+
+    def pack_state(self) -> bytes:
+        values = Struct(f'<{len(self.STATE)}q').pack(*[int(getattr(self, name)) for name in self.STATE])
+        return values + b''.join(bytes(buffer) for buffer in self.state_buffers())
+
+    def state_size(self) -> int:
+        return 8 * len(self.STATE) + sum(map(len, self.state_buffers()))
+
+    def check_state(self, data: bytes) -> None:
+        # raises ValueError for state unpack_state() cannot take, before anything is changed
+        if len(data) != self.state_size():
+            raise ValueError(f'state of {len(data)} bytes does not fit {self.name}')
+
+    def unpack_state(self, data: bytes) -> None:
+        if len(data) != self.state_size():
+            raise ValueError(f'state of {len(data)} bytes does not fit {self.name}')
+        values = Struct(f'<{len(self.STATE)}q')
+        buffers = self.state_buffers()
+        for name, value in zip(self.STATE, values.unpack_from(data)):
+            # keep bools bools
+            setattr(self, name, type(getattr(self, name))(value))
+        offset = values.size
+        for buffer in buffers:
+            buffer[:] = data[offset:offset + len(buffer)]
+            offset += len(buffer)
+
     def read(self, addr:t16)->t8:
         raise NotImplementedError
 
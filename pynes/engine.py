@@ -1,30 +1,296 @@
-import pygame
+import queue
+import threading
+import time
+from typing import Union
+try:
+    import pygame
+except ImportError:
+    pygame = None
 
-class Engine:
-    def __init__(self):
-        pygame.init()
-        self.screen = pygame.display.set_mode([256, 240])
-        self.screen.fill((0, 0, 0))
+# frames per second of the NTSC NES
+FRAME_RATE = 60.0988
+# how far behind a paced window may fall before it stops catching up
+PACE_SLACK = 0.1
+
+
+def frame_bytes(frame) -> bytes:
+    # 256x240 RGB frames come as bytes or as anything with tobytes(), like
+    # arrays, memoryviews and NumPy arrays
+    return frame if isinstance(frame, (bytes, bytearray)) else frame.tobytes()
+
+
+class Pacer:
+    # Sleeps so that calls to wait() come rate times a second, starting over
+    # after a stall rather than rushing to catch up.
+    def __init__(self, rate: float = FRAME_RATE):
+        self.rate = rate
+        self.next_frame = None
+
+    def wait(self) -> None:
+        now = time.perf_counter()
+        if self.next_frame is None or now > self.next_frame + PACE_SLACK:
+            self.next_frame = now
+        elif now < self.next_frame:
+            time.sleep(self.next_frame - now)
+        self.next_frame += 1 / self.rate
+
+
+class VideoBackend:
+    # Where the PPU sends finished frames. A backend with draws = False never
+    # looks at pixels, so the PPU does not produce them at all.
+    draws = True
+    finished = False
+    # a window SDL only lets the main thread drive; ThreadedEngine then runs
+    # just prepare() and pace() on its thread and show() on the main one
+    main_thread = False
+
+    def draw_frame(self, rgb: bytes) -> None:
+        raise NotImplementedError
+
+    def update(self) -> None:
+        pass
+
+    def present(self, frame) -> None:
+        # a finished frame, drawn and shown in one go
+        self.draw_frame(frame)
+        self.update()
+
+    def poll(self) -> None:
+        # keeps a window responsive between frames without showing anything
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class Engine(VideoBackend):
+    # pygame window, opened when the first frame arrives, scale times the size
+    # of the picture; vsync waits for the display and pace for FRAME_RATE
+    main_thread = True
+
+    def __init__(self, scale: int = 1, vsync: bool = False, pace: bool = False):
+        if pygame is None:
+            raise RuntimeError('the pygame video backend needs pygame installed')
+        self.scale = scale
+        self.vsync = vsync
+        self.pacer = Pacer() if pace else None
+        self.screen = None
         self.running = False
         self.finished = False
-    
+
+    def open(self):
+        pygame.init()
+        self.screen = pygame.display.set_mode([256 * self.scale, 240 * self.scale],
+                                              pygame.SCALED if self.vsync else 0, vsync=int(self.vsync))
+        self.screen.fill((0, 0, 0))
+
     def set_pixel(self, x, y, color):
+        if self.screen is None:
+            self.open()
         self.screen.set_at((x, y), color)
 
+    def prepare(self, rgb):
+        # the frame as a surface the size of the window, which needs no display
+        # and so may be made on another thread
+        image = pygame.image.frombuffer(frame_bytes(rgb), (256, 240), 'RGB')
+        if self.scale != 1:
+            image = pygame.transform.scale(image, (256 * self.scale, 240 * self.scale))
+        return image
+
+    def draw_frame(self, rgb):
+        if self.screen is None:
+            self.open()
+        self.screen.blit(self.prepare(rgb), (0, 0))
+
     def update(self):
+        self.flip()
+        if self.running:
+            self.pace()
+
+    def show(self, image):
+        # draws a prepare()d frame and flips, leaving pacing to the caller
+        if self.screen is None and not self.finished:
+            self.open()
+        if not self.finished:
+            self.screen.blit(image, (0, 0))
+        self.flip()
+
+    def pace(self):
+        if self.pacer:
+            self.pacer.wait()
+
+    def flip(self):
+        if self.screen is None and not self.finished:
+            self.open()
         if not self.finished:
             self.running = True
         if self.running:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.running = False
+            self.handle_events()
             pygame.display.flip()
         if not self.running:
             self.finished = True
             pygame.quit()
 
+    def handle_events(self):
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.running = False
+
+    def poll(self):
+        if self.running:
+            self.handle_events()
+            if not self.running:
+                self.finished = True
+                pygame.quit()
+
+
+class OffscreenEngine(VideoBackend):
+    # keeps the last frame as 256x240 RGB bytes
+    def __init__(self):
+        self.frame = bytes(256 * 240 * 3)
+        self.frames = 0
+
+    def draw_frame(self, rgb):
+        self.frame = frame_bytes(rgb)
+
+    def update(self):
+        self.frames += 1
+
+
+class ThreadedEngine(VideoBackend):
+    # Shows frames from another backend on a presenter thread, so emulation
+    # goes on with the next frame while the last one is drawn and flipped.
+    # For a main_thread backend the presenter only prepares and paces frames,
+    # present() and close() show them on the calling thread.
+    # buffers counts the frame on screen and those waiting; when they are all
+    # taken, policy 'block' waits for the presenter, 'drop' discards the new
+    # frame and 'overwrite' discards the oldest waiting one instead. Once the
+    # wrapped backend is finished frames are dropped rather than waited on.
+    POLICIES = ('block', 'drop', 'overwrite')
+
+    def __init__(self, engine: VideoBackend = None, buffers: int = 2, policy: str = 'block'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'unknown policy {policy!r}, expected one of {", ".join(self.POLICIES)}')
+        if buffers < 2:
+            raise ValueError(f'need at least 2 buffers, got {buffers}')
+        self.engine = Engine() if engine is None else engine
+        self.draws = self.engine.draws
+        self.policy = policy
+        self.pending = queue.Queue(maxsize=buffers - 1)
+        # frames the presenter prepared for a main_thread backend to show
+        self.ready = queue.Queue()
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.present_frames, daemon=True)
+        self.thread.start()
+
+    @property
+    def finished(self) -> bool:
+        return self.engine.finished
+
+    def draw_frame(self, rgb):
+        self.present(rgb)
+
+    def present(self, frame) -> None:
+        frame = bytes(frame_bytes(frame))
+        self.show_ready()
+        if self.policy == 'block':
+            if not self.put(frame):
+                self.dropped += 1
+            return
+        try:
+            self.pending.put_nowait(frame)
+            return
+        except queue.Full:
+            pass
+        if self.policy == 'drop':
+            self.dropped += 1
+            return
+        try:
+            self.pending.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        self.pending.put_nowait(frame)
+
+    def put(self, item) -> bool:
+        # waits for room while the presenter is still taking frames
+        while self.thread.is_alive() and not self.engine.finished:
+            try:
+                self.pending.put(item, timeout=1 / FRAME_RATE)
+                return True
+            except queue.Full:
+                self.show_ready()
+        return False
+
+    def show_ready(self) -> None:
+        # on the main thread: the frames prepared since, and window events
+        if not self.engine.main_thread:
+            return
+        while not self.engine.finished:
+            try:
+                image = self.ready.get_nowait()
+            except queue.Empty:
+                break
+            self.engine.show(image)
+        self.engine.poll()
+
+    def present_frames(self) -> None:
+        # the presenter thread, which keeps polling events between frames
+        # unless the main thread does
+        while not self.engine.finished:
+            try:
+                frame = self.pending.get(timeout=1 / FRAME_RATE)
+            except queue.Empty:
+                if not self.engine.main_thread:
+                    self.engine.poll()
+                continue
+            if frame is None:
+                break
+            if self.engine.main_thread:
+                image = self.engine.prepare(frame)
+                self.engine.pace()
+                self.ready.put(image)
+            else:
+                self.engine.present(frame)
+
+    def close(self) -> None:
+        # shows the frames still waiting and stops the presenter
+        if self.put(None):
+            self.thread.join()
+        self.show_ready()
+
+
+class NullEngine(VideoBackend):
+    # counts frames and nothing else
+    draws = False
+
+    def __init__(self):
+        self.frames = 0
+
+    def draw_frame(self, rgb):
+        pass
+
+    def update(self):
+        self.frames += 1
+
+
+VIDEO_BACKENDS = {
+    'pygame': Engine,
+    'offscreen': OffscreenEngine,
+    'null': NullEngine,
+    'threaded': ThreadedEngine,
+}
+
+
+def make_engine(video: Union[str, VideoBackend]) -> VideoBackend:
+    if isinstance(video, VideoBackend):
+        return video
+    if video not in VIDEO_BACKENDS:
+        raise ValueError(f'unknown video backend {video!r}, expected one of {", ".join(VIDEO_BACKENDS)}')
+    return VIDEO_BACKENDS[video]()
+
+
 if __name__ == '__main__':
     e = Engine()
     for i in range(10000):
         e.update()
-
@@ -0,0 +1,26 @@
+from array import array
+
+# The CPU keeps the last result that sets N and Z in `nz` and only turns it into
+# flag bits when the status byte is read. Z is set when the low byte is zero and
+# N when bit 7 or bit 8 is set, so 0x100 stands for N and Z together.
+NZ_FLAGS = tuple((0x02 if not i & 0xFF else 0x00) | (0x80 if i & 0x180 else 0x00) for i in range(512))
+
+# an `nz` value reproducing the N and Z bits of a status byte
+NZ_RESULT = tuple((0x100 if s & 0x80 else 0x00) if s & 0x02 else (s & 0x80) | 0x01 for s in range(256))
+
+
+def _carry_entry(a: int, m: int, c: int, invert: int) -> int:
+    # SBC takes V from the operand before inversion, like the interpreter always did
+    t = a + (m ^ invert) + c
+    return (t & 0xFF) | ((t > 0xFF) | ((~(a ^ m) & (a ^ t) & 0x80) >> 1)) << 8
+
+
+def _carry_table(invert: int) -> array:
+    # indexed by carry << 16 | a << 8 | operand, result byte | (C | V) << 8
+    return array('H', (_carry_entry(a, m, c, invert) for c in range(2) for a in range(256) for m in range(256)))
+
+
+ADC_TABLE = _carry_table(0x00)
+SBC_TABLE = _carry_table(0xFF)
+# indexed by register << 8 | operand, difference byte | C << 8
+CMP_TABLE = array('H', ((r - m) & 0xFF | (r >= m) << 8 for r in range(256) for m in range(256)))
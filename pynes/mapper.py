@@ -1,14 +1,34 @@
-from pynes.bits import assert_u16
+from pynes.bits import assert_u16, assert_u8
 from typing import Tuple
 from pynes.bits import uint8, uint16, u8, u16, t16, t8
 from pynes.device import Device
 
 
 class Mapper(Device):
+    CHECKS = {
+        'cpuMapRead': ((assert_u16,), None),
+        'cpuMapWrite': ((assert_u16, assert_u8), None),
+        'ppuMapRead': ((assert_u16,), None),
+        'ppuMapWrite': ((assert_u16, assert_u8), None),
+    }
+
     def __init__(self, prgBanks, chrBanks, name: str = None) -> None:
         super().__init__(name)
         self.nPRGBanks = prgBanks
         self.nCHRBanks = chrBanks
+        # (listener, cpu, ppu): whether it follows the CPU side, PRG banks, and
+        # the PPU side, CHR banks and mirroring
+        self.listeners = []
+
+    def add_listener(self, listener, cpu: bool = True, ppu: bool = True) -> None:
+        self.listeners.append((listener, cpu, ppu))
+
+    def notify(self, cpu: bool = True, ppu: bool = True) -> None:
+        # called by mappers whenever a bank or mirroring register changes, with
+        # the side it changed
+        for listener, on_cpu, on_ppu in self.listeners:
+            if (cpu and on_cpu) or (ppu and on_ppu):
+                listener()
 
     def cpuMapRead(self, addr:t16) -> Tuple[t16, bool]:
         raise NotImplementedError
@@ -20,51 +40,51 @@ class Mapper(Device):
         raise NotImplementedError
     def scanline(self) -> None:
         return
+    def mirror(self) -> int:
+        # the mirroring the mapper has selected, None for the board's own
+        return None
 
 class Mapper000(Mapper):
     def __init__(self, prgBanks, chrBanks, name: str = None) -> None:
         super().__init__(prgBanks, chrBanks, name=name)
 
     def cpuMapRead(self, addr:t16) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if 0x8000 <= addr <= 0xFFFF:
             mapped_addr = addr & (0x7FFF if self.nPRGBanks > 1 else 0x3FFF)
             return mapped_addr, True
         else:
-            return u16(), False
+            return 0, False
 
     def cpuMapWrite(self, addr: t16, value: t8) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if 0x8000 <= addr <= 0xFFFF:
             mapped_addr = addr & (0x7FFF if self.nPRGBanks > 1 else 0x3FFF)
             return mapped_addr, True
         else:
-            return u16(), False
+            return 0, False
 
     def ppuMapRead(self, addr: t16) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if 0x0000 <= addr <= 0x1FFF:
             return addr, True
         else:
-            return u16(), False
+            return 0, False
 
     def ppuMapWrite(self, addr: t16, value: t8) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if 0x0000 <= addr <= 0x1FFF:
             if self.nCHRBanks == 0:
                 return addr, True
-        return u16(), False
+        return 0, False
 
     def reset(self) -> None:
         pass
 
 class Mapper003(Mapper):
+    STATE = ('nCHRBankSelect',)
+
     def __init__(self, prgBanks, chrBanks, name: str = None) -> None:
         super().__init__(prgBanks, chrBanks, name=name)
         self.nCHRBankSelect = u8()
 
     def cpuMapRead(self, addr:t16) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if 0x8000 <= addr <= 0xFFFF:
             if self.nPRGBanks == 1:
                 mapped_addr = addr & 0x3FFF
@@ -72,24 +92,23 @@ class Mapper003(Mapper):
                 mapped_addr = addr & 0x7FFF
             return mapped_addr, True
         else:
-            return u16(), False
+            return 0, False
 
     def cpuMapWrite(self, addr: t16, value: t8) -> Tuple[t16, bool]:
-        assert_u16(addr)
-        if 0x8000 <= addr <= 0xFFFF:
+        if 0x8000 <= addr <= 0xFFFF and self.nCHRBankSelect != value & 0x03:
             self.nCHRBankSelect = value & 0x03
+            self.notify(cpu=False)
         return addr, False
 
     def ppuMapRead(self, addr: t16) -> Tuple[t16, bool]:
-        assert_u16(addr)
         if addr < 0x2000:
             return self.nCHRBankSelect * 0x2000 + addr, True
         else:
             return None, False
 
     def ppuMapWrite(self, addr: t16, value: t8) -> Tuple[t16, bool]:
-        assert_u16(addr)
-        return u16(), False
+        return 0, False
 
     def reset(self) -> None:
         self.nCHRBankSelect = u8()
+        self.notify(cpu=False)
@@ -1,10 +1,16 @@
-from loguru import logger
-from pynes.bits import assert_u16
+from pynes.bits import assert_u16, assert_u8
 from easydict import EasyDict
-from pynes.bits import uint8, uint16, u8, u16, t8, t16, mtx, flipbyte
+from pynes.bits import uint8, uint16, u8, u16, t8, t16, flipbyte
 from pynes.device import Device
-from pynes.cartridge import Cartridge, VERTICAL, HORIZONTAL
-from pynes.engine import Engine
+from pynes.trace import Traceable, PPU_READ, PPU_WRITE
+from pynes.cartridge import Cartridge, VERTICAL, HORIZONTAL, ONESCREEN_LO, ONESCREEN_HI, FOURSCREEN
+from pynes.engine import VideoBackend, make_engine
+from functools import lru_cache
+from typing import List, Tuple, Union
+try:
+    import numpy as np
+except ImportError:
+    np = None
 exit_flag = 0
 palScreen = [None] * 0x40
 palScreen[0x00] = (84, 84, 84)
@@ -117,6 +123,25 @@ LOOPY_FLAG = EasyDict(
     unused = 1 << 15,
 )
 
+# palette RAM index of each palette << 2 | pixel, sprite backdrops mirror the background ones
+PALETTE_FOLD = tuple(i & 0x0F if i & 0x13 == 0x10 else i for i in range(32))
+
+# the 1 KiB page behind each of the four nametables under each mirroring,
+# pages 2 and 3 are the cartridge's own nametable RAM
+NAME_PAGES = {
+    HORIZONTAL: (0, 0, 1, 1),
+    VERTICAL: (0, 1, 0, 1),
+    ONESCREEN_LO: (0, 0, 0, 0),
+    ONESCREEN_HI: (1, 1, 1, 1),
+    FOURSCREEN: (0, 1, 2, 3),
+}
+
+# sprite pixels of a line without sprites, see sprite_row()
+NO_SPRITES = bytes(264)
+
+# what the channels not being emphasized are scaled by
+EMPHASIS_DIM = 0.816
+
 OAM_L = EasyDict(
     y = 0,
     id = 1,
@@ -130,24 +155,74 @@ def set_flag(reg, reg2, flag):
     reg &= reg2 | ~flag
     return reg
 
-class PPU(Device):
-    def __init__(self, name: str=None) -> None:
+def tile_bytes(tile):
+    # the bytes a fetched (lsb, msb, attrib, pixels) tile puts in the four background shifters
+    lsb, msb, attrib = tile[:3]
+    return lsb, msb, 0xFF if attrib & 0b01 else 0x00, 0xFF if attrib & 0b10 else 0x00
+
+@lru_cache(maxsize=None)
+def rgb_table(mask: int) -> bytes:
+    # RGB bytes of the 64 colours under the grayscale and emphasis bits of mask
+    table = bytearray()
+    emphasised = {channel for channel, flag in
+                  enumerate((MASK_FLAG.enhance_red, MASK_FLAG.enhance_green, MASK_FLAG.enhance_blue)) if mask & flag}
+    for colour in range(64):
+        if mask & MASK_FLAG.grayscale:
+            colour &= 0x30
+        rgb = palScreen[colour]
+        if emphasised:
+            # each channel not emphasised is dimmed once, all three when all are
+            rgb = [value if i in emphasised and len(emphasised) < 3 else int(value * EMPHASIS_DIM)
+                   for i, value in enumerate(rgb)]
+        table += bytes(rgb)
+    return bytes(table)
+
+class PPU(Device, Traceable):
+    CHECKS = {
+        'read': ((assert_u16,), assert_u8),
+        'write': ((assert_u16, assert_u8), None),
+        'ppuRead': ((assert_u16,), assert_u8),
+        'ppuWrite': ((assert_u16, assert_u8), None),
+    }
+    STATE = ('status', 'mask', 'control', 'vram_addr', 'tram_addr', 'fine_x', 'address_latch', 'ppu_data_buffer',
+             'oam_addr', 'bg_next_tile_id', 'bg_next_tile_attrib', 'bg_next_tile_lsb', 'bg_next_tile_msb',
+             'bg_shifter_pattern_lo', 'bg_shifter_pattern_hi', 'bg_shifter_attrib_lo', 'bg_shifter_attrib_hi',
+             'nmi', 'scanline', 'cycle', 'n_frame', 'odd_frame', 'frame_complete', 'sprite_count',
+             'bSpriteZeroHitPossible', 'bSpriteZeroBeingRendered')
+    STATE_BUFFERS = ('tblName', 'tblPattern', 'tblPalette', 'OAM', 'spriteScanline', 'sprite_shifter_pattern_lo',
+                     'sprite_shifter_pattern_hi')
+
+    def __init__(self, name: str=None, line_renderer: bool=False, video: Union[str, VideoBackend]='pygame',
+                 render_every: int=1) -> None:
         super().__init__(name=name)
+        # run() draws scanlines it covers from start to end with render_line()
+        self.line_renderer = line_renderer
+        # frames whose number is a multiple of render_every are drawn, the rest
+        # only keep the status bits up to date; 0 draws requested frames only
+        self.render_every = render_every
+        self.frame_requested = False
+        self.frames_rendered = 0
+        self.frames_skipped = 0
 
-        self.tblName = mtx(0, (2, 1024))
-        self.tblPattern = mtx(0, (2, 4096))
-        self.tblPalette = mtx(size=32)
+        # flat buffers: two 1 KiB nametables, two 4 KiB pattern tables, and
+        # images stored row by row; the screen holds colour indices, see frame_rgb()
+        self.tblName = bytearray(2 * 1024)
+        # (memory, offset) of the four nametables, see map_names()
+        self.name_pages = [(self.tblName, page << 10) for page in NAME_PAGES[VERTICAL]]
+        self.tblPattern = bytearray(2 * 4096)
+        self.tblPalette = bytearray(32)
 
         self.palScreen = palScreen
-        self.sprScreen = mtx(0, (256, 240, 3))
-        self.sprNameTable = mtx(0, (2, 256, 240))
-        self.sprPatternTable = mtx(0, (2, 128, 128, 3))
+        self.sprScreen = bytearray(240 * 256)
+        self.sprPatternTable = bytearray(2 * 128 * 128 * 3)
         self.frame_complete = False
         self.scanline = 0
         self.n_frame = 1
         self.cycle = 0
         self.cartridge:Cartridge = None
-        self.engine = Engine()
+        # CHR tile index in the cartridge of each of the 512 pattern tiles, see map_tiles()
+        self.chr_tiles = None
+        self.set_engine(make_engine(video))
         self.status = u8()
         self.mask = u8()
         self.control = u8()
@@ -165,24 +240,32 @@ class PPU(Device):
         self.bg_shifter_attrib_lo = u16()
         self.bg_shifter_attrib_hi = u16()
         self.nmi = False
-        self.OAM = mtx(0, (64, 4))
-        self.spriteScanline = mtx(0, (8, 4))
+        self.oam_addr = u8()
+        # 64 and 8 sprites of 4 bytes each, see OAM_L and sprite()
+        self.OAM = bytearray(64 * 4)
+        self.spriteScanline = bytearray(8 * 4)
         self.sprite_count = 0
-        self.sprite_shifter_pattern_lo = [0] * 8
-        self.sprite_shifter_pattern_hi = [0] * 8
+        self.sprite_shifter_pattern_lo = bytearray(8)
+        self.sprite_shifter_pattern_hi = bytearray(8)
         self.bSpriteZeroHitPossible = False
         self.bSpriteZeroBeingRendered = False
+        # OAM entries on each scanline in OAM order, with the sprite y bytes and
+        # height they were bucketed for, see sprite_rows()
+        self.oam_rows = None
+        self.oam_rows_key = None
+        # pixels of the sprites fetched for the current line, see sprite_row()
+        self.sprite_pixels = NO_SPRITES
         self.odd_frame = False
+        self.init_trace()
 
     def read(self, addr: t16) -> t8:
-        assert_u16(addr)
         data = 0x0
         if addr == 0x0002:
             data = (self.status & 0xE0) | (self.ppu_data_buffer & 0x1F)
             self.status &= ~STATUS_FLAG.vertical_blank
             self.address_latch = 0
         elif addr == 0x0004:
-            data = self.OAM[self.oam_addr // 4][self.oam_addr % 4]
+            data = self.OAM[self.oam_addr]
         elif addr == 0x0007:
             data = self.ppu_data_buffer
             self.ppu_data_buffer = self.ppuRead(self.vram_addr)
@@ -195,7 +278,6 @@ class PPU(Device):
         return data
     
     def write(self, addr: t16, data: t8) -> None:
-        assert_u16(addr)
         if addr == 0x0000:
             self.control = data
             self.tram_addr = set_flag(self.tram_addr, self.control << 10, LOOPY_FLAG.nametable_x | LOOPY_FLAG.nametable_y)
@@ -206,7 +288,7 @@ class PPU(Device):
         elif addr == 0x0003:
             self.oam_addr = data
         elif addr == 0x0004:
-            self.OAM[self.oam_addr // 4][self.oam_addr % 4] = data
+            self.OAM[self.oam_addr] = data
         elif addr == 0x0005:
             if self.address_latch == 0:
                 self.fine_x = data & 0x07
@@ -229,33 +311,15 @@ class PPU(Device):
             self.vram_addr += (32 if self.control & CONTROL_FLAG.increment_mode else 1)
 
     def ppuRead(self, addr: t16) -> t8:
-        assert_u16(addr)
         addr &= 0x3FFF
         data = self.cartridge.ppuRead(addr=addr)
         if data is not False:
             pass
         elif 0x0000 <= addr <= 0x1FFF:
-            data = self.tblPattern[(addr & 0x1000) >> 12][addr & 0x0FFF]
+            data = self.tblPattern[addr]
         elif 0x2000 <= addr <= 0x3EFF:
-            addr &= 0x0FFF
-            if self.cartridge.mirror == VERTICAL:
-                if 0x0000 <= addr <= 0x03FF:
-                    data = self.tblName[0][addr & 0x03FF]
-                if 0x0400 <= addr <= 0x07FF:
-                    data = self.tblName[1][addr & 0x03FF]
-                if 0x0800 <= addr <= 0x0BFF:
-                    data = self.tblName[0][addr & 0x03FF]
-                if 0x0C00 <= addr <= 0x0FFF:
-                    data = self.tblName[1][addr & 0x03FF]
-            elif self.cartridge.mirror == HORIZONTAL:
-                if 0x0000 <= addr <= 0x03FF:
-                    data = self.tblName[0][addr & 0x03FF]
-                if 0x0400 <= addr <= 0x07FF:
-                    data = self.tblName[0][addr & 0x03FF]
-                if 0x0800 <= addr <= 0x0BFF:
-                    data = self.tblName[1][addr & 0x03FF]
-                if 0x0C00 <= addr <= 0x0FFF:
-                    data = self.tblName[1][addr & 0x03FF]
+            memory, offset = self.name_pages[(addr >> 10) & 3]
+            data = memory[offset | (addr & 0x03FF)]
         elif 0x3F00 <= addr <= 0x3FFF:
             addr &= 0x001F
             if addr == 0x0010: addr = 0x0000
@@ -266,33 +330,14 @@ class PPU(Device):
         return data
 
     def ppuWrite(self, addr: t16, data: t8) -> None:
-        assert_u16(addr)
-        logger.debug('ppuWrite, addr=0x{:04x}, data=0x{:02x}', addr, data)
         addr = addr & 0x3FFF
         if self.cartridge.ppuWrite(addr=addr, data=data):
             return
         elif 0x0000 <= addr <= 0x1FFF:
-            self.tblPattern[(addr & 0x1000) >> 12, addr & 0x0FFF] = data
+            self.tblPattern[addr] = data
         elif 0x2000 <= addr <= 0x3EFF:
-            addr &= 0x0FFF
-            if self.cartridge.mirror == VERTICAL:
-                if 0x0000 <= addr <= 0x03FF:
-                    self.tblName[0][addr & 0x03FF] = data
-                if 0x0400 <= addr <= 0x07FF:
-                    self.tblName[1][addr & 0x03FF] = data
-                if 0x0800 <= addr <= 0x0BFF:
-                    self.tblName[0][addr & 0x03FF] = data
-                if 0x0C00 <= addr <= 0x0FFF:
-                    self.tblName[1][addr & 0x03FF] = data
-            elif self.cartridge.mirror == HORIZONTAL:
-                if 0x0000 <= addr <= 0x03FF:
-                    self.tblName[0][addr & 0x03FF] = data
-                if 0x0400 <= addr <= 0x07FF:
-                    self.tblName[0][addr & 0x03FF] = data
-                if 0x0800 <= addr <= 0x0BFF:
-                    self.tblName[1][addr & 0x03FF] = data
-                if 0x0C00 <= addr <= 0x0FFF:
-                    self.tblName[1][addr & 0x03FF] = data
+            memory, offset = self.name_pages[(addr >> 10) & 3]
+            memory[offset | (addr & 0x03FF)] = data
         elif 0x3F00 <= addr <= 0x3FFF:
             addr &= 0x001F
             if addr == 0x0010: addr = 0x0000
@@ -303,8 +348,57 @@ class PPU(Device):
         return data
 
 
+    def map_names(self) -> None:
+        # called when the cartridge is connected or its mapper switches mirroring
+        pages = NAME_PAGES[self.cartridge.mirror]
+        self.name_pages = [(self.tblName, page << 10) if page < 2 else (self.cartridge.vNameMemory, (page - 2) << 10)
+                           for page in pages]
+
+    def sprite(self, i: int) -> bytearray:
+        # a copy of the y, id, attribute and x bytes of sprite i on this scanline
+        return self.spriteScanline[i * 4:i * 4 + 4]
+
+    def dot(self) -> int:
+        return self.n_frame * 262 * 341 + (self.scanline + 1) * 341 + self.cycle
+
+    def traced_ppu_read(self, addr: t16) -> t8:
+        data = PPU.ppuRead(self, addr)
+        self.record(addr, data, PPU_READ, self.dot())
+        return data
+
+    def traced_ppu_write(self, addr: t16, data: t8) -> None:
+        PPU.ppuWrite(self, addr, data)
+        self.record(addr, data, PPU_WRITE, self.dot())
+
+    def install_trace(self, enabled: bool) -> None:
+        if enabled:
+            self.ppuRead = self.traced_ppu_read
+            self.ppuWrite = self.traced_ppu_write
+        else:
+            del self.ppuRead, self.ppuWrite
+        self.install_checks('ppuRead', 'ppuWrite')
+
+    def set_engine(self, engine: VideoBackend) -> None:
+        self.engine = engine
+        self.plan_frame()
+
     def ConnectCartridge(self, cartridge:Cartridge) -> None:
         self.cartridge = cartridge
+        cartridge.mapper.add_listener(self.map_tiles, cpu=False)
+        cartridge.mapper.add_listener(self.map_names, cpu=False)
+        self.map_tiles()
+        self.map_names()
+
+    def map_tiles(self) -> None:
+        # tiles the mapper places whole in CHR memory get an index into the
+        # cartridge's decoded tiles, the rest None and are read through ppuRead()
+        mapper = self.cartridge.mapper
+        self.chr_tiles = [None] * 512
+        for tile in range(512):
+            mapped_addr, mapped = mapper.ppuMapRead(tile << 4)
+            if mapped and mapped_addr + 16 <= len(self.cartridge.vCHRMemory) and \
+                    mapper.ppuMapRead(tile << 4 | 0x0F) == (mapped_addr + 0x0F, True):
+                self.chr_tiles[tile] = mapped_addr >> 4
 
     
     def IncrementScrollX(self):
@@ -346,17 +440,108 @@ class PPU(Device):
 
     def UpdateShifters(self):
         if self.mask & MASK_FLAG.render_background:
-            self.bg_shifter_pattern_lo = u16(self.bg_shifter_pattern_lo << 1)
-            self.bg_shifter_pattern_hi = u16(self.bg_shifter_pattern_hi << 1)
-            self.bg_shifter_attrib_lo = u16(self.bg_shifter_attrib_lo << 1)
-            self.bg_shifter_attrib_hi = u16(self.bg_shifter_attrib_hi << 1)
-        if self.mask & MASK_FLAG.render_sprites and 1 <= self.cycle < 258:
-            for i in range(self.sprite_count):
-                if self.spriteScanline[i][OAM_L.x] > 0:
-                    self.spriteScanline[i][OAM_L.x] -= 1
+            self.bg_shifter_pattern_lo = (self.bg_shifter_pattern_lo << 1) & 0xFFFF
+            self.bg_shifter_pattern_hi = (self.bg_shifter_pattern_hi << 1) & 0xFFFF
+            self.bg_shifter_attrib_lo = (self.bg_shifter_attrib_lo << 1) & 0xFFFF
+            self.bg_shifter_attrib_hi = (self.bg_shifter_attrib_hi << 1) & 0xFFFF
+
+    def sprite_rows(self) -> List[List[int]]:
+        # OAM entries by the scanline they cover, bucketed again only when a y
+        # byte or the sprite height has changed since the last call
+        height = 16 if self.control & CONTROL_FLAG.sprite_size else 8
+        key = (height, self.OAM[OAM_L.y::4])
+        if key != self.oam_rows_key:
+            rows = [[] for _ in range(261)]
+            for n, y in enumerate(key[1]):
+                for line in range(y, min(y + height, 261)):
+                    rows[line].append(n)
+            self.oam_rows, self.oam_rows_key = rows, key
+        return self.oam_rows
+
+    def evaluate_sprites(self) -> None:
+        self.spriteScanline = bytearray(b'\xff' * 8 * 4)
+        self.sprite_shifter_pattern_lo = bytearray(8)
+        self.sprite_shifter_pattern_hi = bytearray(8)
+        self.sprite_pixels = NO_SPRITES
+        row = self.sprite_rows()[self.scanline]
+        entries = row[:8]
+        for i, n in enumerate(entries):
+            self.spriteScanline[i * 4:i * 4 + 4] = self.OAM[n * 4:n * 4 + 4]
+        self.sprite_count = len(entries)
+        self.bSpriteZeroHitPossible = bool(entries) and entries[0] == 0
+        # a ninth sprite in range sets the overflow flag
+        self.status = set_flag(self.status, int(len(row) > 8) * STATUS_FLAG.sprite_overflow, STATUS_FLAG.sprite_overflow)
+
+    def fetch_sprites(self) -> None:
+        for i in range(self.sprite_count):
+            sprite = self.sprite(i)
+            if not (self.control & CONTROL_FLAG.sprite_size):
+                if not (sprite[OAM_L.attribute] & 0x80):
+                    sprite_pattern_addr_lo = (((self.control & CONTROL_FLAG.pattern_sprite) << 9) | 
+                        (sprite[OAM_L.id] << 4) | 
+                        (self.scanline - sprite[OAM_L.y])) & 0xFFFF
                 else:
-                    self.sprite_shifter_pattern_lo[i] = u8(self.sprite_shifter_pattern_lo[i] << 1)
-                    self.sprite_shifter_pattern_hi[i] = u8(self.sprite_shifter_pattern_hi[i] << 1)
+                    sprite_pattern_addr_lo = (((self.control & CONTROL_FLAG.pattern_sprite) << 9) | 
+                        (sprite[OAM_L.id] << 4) | 
+                        (7 - (self.scanline - sprite[OAM_L.y]))) & 0xFFFF
+            else:
+                if not (sprite[OAM_L.attribute] & 0x80):
+                    if self.scanline - sprite[OAM_L.y] < 8:
+                        sprite_pattern_addr_lo = (
+                            ((sprite[OAM_L.id] & 0x01) << 12) | 
+                            ((sprite[OAM_L.id] & 0xFE) << 4) | 
+                            ((self.scanline - sprite[OAM_L.y]) & 0x07)) & 0xFFFF
+                    else:
+                        sprite_pattern_addr_lo = (
+                            ((sprite[OAM_L.id] & 0x01) << 12) | 
+                            (((sprite[OAM_L.id] & 0xFE) + 1) << 4) | 
+                            ((self.scanline - sprite[OAM_L.y]) & 0x07)) & 0xFFFF
+                else:
+                    if self.scanline - sprite[OAM_L.y] < 8:
+                        sprite_pattern_addr_lo = (
+                            ((sprite[OAM_L.id] & 0x01) << 12) | 
+                            (((sprite[OAM_L.id] & 0xFE) + 1) << 4) | 
+                            ((7 - (self.scanline - sprite[OAM_L.y])) & 0x07)) & 0xFFFF
+                    else:
+                        sprite_pattern_addr_lo = (
+                            ((sprite[OAM_L.id] & 0x01) << 12) | 
+                            ((sprite[OAM_L.id] & 0xFE) << 4) | 
+                            ((7 - (self.scanline - sprite[OAM_L.y])) & 0x07)) & 0xFFFF
+            index = self.chr_tiles[sprite_pattern_addr_lo >> 4] \
+                if self.chr_tiles and sprite_pattern_addr_lo < 0x2000 and not self.observers else None
+            if index is not None:
+                tile = self.cartridge.tile(index)
+                planes = tile.flipped_planes if sprite[OAM_L.attribute] & 0x40 else tile.planes
+                sprite_pattern_bits_lo = planes[sprite_pattern_addr_lo & 0x07]
+                sprite_pattern_bits_hi = planes[(sprite_pattern_addr_lo & 0x07) + 8]
+            else:
+                sprite_pattern_addr_hi = (sprite_pattern_addr_lo + 8) & 0xFFFF
+                sprite_pattern_bits_lo = self.ppuRead(sprite_pattern_addr_lo)
+                sprite_pattern_bits_hi = self.ppuRead(sprite_pattern_addr_hi)
+                if sprite[OAM_L.attribute] & 0x40:
+                    sprite_pattern_bits_lo = flipbyte(sprite_pattern_bits_lo)
+                    sprite_pattern_bits_hi = flipbyte(sprite_pattern_bits_hi)
+            self.sprite_shifter_pattern_lo[i] = sprite_pattern_bits_lo
+            self.sprite_shifter_pattern_hi[i] = sprite_pattern_bits_hi
+        self.sprite_pixels = self.sprite_row()
+
+    def sprite_row(self) -> bytes:
+        # the fetched sprites' pixels by x: palette << 2 | pixel of the first
+        # opaque sprite, with 0x20 set for sprites in front and 0x40 for sprite 0,
+        # 0 where all are transparent
+        if not self.sprite_count:
+            return NO_SPRITES
+        row = bytearray(264)
+        for i in range(self.sprite_count - 1, -1, -1):
+            y, tile_id, attribute, x = self.sprite(i)
+            lo = self.sprite_shifter_pattern_lo[i]
+            hi = self.sprite_shifter_pattern_hi[i]
+            tag = (16 + ((attribute & 0x03) << 2)) | (0 if attribute & 0x20 else 0x20) | (0x40 if i == 0 else 0)
+            for bit in range(7, -1, -1):
+                pixel = ((hi >> bit) & 1) << 1 | ((lo >> bit) & 1)
+                if pixel:
+                    row[x + 7 - bit] = tag | pixel
+        return row
 
     def clock(self) -> None:
         if self.scanline >= -1 and self.scanline < 240:
@@ -364,8 +549,9 @@ class PPU(Device):
                 self.cycle = 1
             if self.scanline == -1 and self.cycle == 1:
                 self.status &= ~(STATUS_FLAG.vertical_blank | STATUS_FLAG.sprite_overflow | STATUS_FLAG.sprite_zero_hit)
-                self.sprite_shifter_pattern_lo = [0] * 8
-                self.sprite_shifter_pattern_hi = [0] * 8
+                self.sprite_shifter_pattern_lo = bytearray(8)
+                self.sprite_shifter_pattern_hi = bytearray(8)
+                self.sprite_pixels = NO_SPRITES
             if (self.cycle >= 2 and self.cycle < 258) or (self.cycle >= 321 and self.cycle < 338):
                 self.UpdateShifters()
                 switch = (self.cycle - 1) % 8
@@ -409,65 +595,15 @@ class PPU(Device):
 
             if self.scanline == -1 and self.cycle >= 280 and self.cycle < 305:
                 self.TransferAddressY()
-        if self.cycle == 257 and self.scanline >= 0:
-            self.spriteScanline = mtx(255, (8, 4))
-            self.sprite_count = 0
-            self.sprite_shifter_pattern_lo = mtx(0, 8)
-            self.sprite_shifter_pattern_hi = mtx(0, 8)
-            nOAMEntry = 0
-            self.bSpriteZeroHitPossible = False
-            while nOAMEntry < 64 and self.sprite_count < 9:
-                diff = self.scanline - self.OAM[nOAMEntry][OAM_L.y]
-                if diff >= 0 and diff < (16 if self.control & CONTROL_FLAG.sprite_size else 8) and self.sprite_count < 8:
-                    if self.sprite_count < 8:
-                        if nOAMEntry == 0:
-                            self.bSpriteZeroHitPossible = True
-                        self.spriteScanline[self.sprite_count] = self.OAM[nOAMEntry][:]
-                    self.sprite_count += 1
-                nOAMEntry += 1
-            self.status = set_flag(self.status, int(self.sprite_count > 8) * STATUS_FLAG.sprite_overflow, STATUS_FLAG.sprite_overflow)
+        if self.cycle == 257:
+            if self.scanline >= 0:
+                self.evaluate_sprites()
+            elif self.mask & MASK_FLAG.render_sprites:
+                # the pre-render line has moved the sprites it kept all the way left
+                for i in range(self.sprite_count):
+                    self.spriteScanline[i * 4 + OAM_L.x] = 0
         if self.cycle == 340:
-            for i in range(self.sprite_count):
-                if not (self.control & CONTROL_FLAG.sprite_size):
-                    if not (self.spriteScanline[i][OAM_L.attribute] & 0x80):
-                        sprite_pattern_addr_lo = u16(((self.control & CONTROL_FLAG.pattern_sprite) << 9) | 
-                            (self.spriteScanline[i][OAM_L.id] << 4) | 
-                            (self.scanline - self.spriteScanline[i][OAM_L.y]))
-                    else:
-                        sprite_pattern_addr_lo = u16(((self.control & CONTROL_FLAG.pattern_sprite) << 9) | 
-                            (self.spriteScanline[i][OAM_L.id] << 4) | 
-                            (7 - (self.scanline - self.spriteScanline[i][OAM_L.y])))
-                else:
-                    if not (self.spriteScanline[i][OAM_L.attribute] & 0x80):
-                        if self.scanline - self.spriteScanline[i][OAM_L.y] < 8:
-                            sprite_pattern_addr_lo = u16(
-                                ((self.spriteScanline[i][OAM_L.id] & 0x01) << 12) | 
-                                ((self.spriteScanline[i][OAM_L.id] & 0xFE) << 4) | 
-                                ((self.scanline - self.spriteScanline[i][OAM_L.y]) & 0x07))
-                        else:
-                            sprite_pattern_addr_lo = u16(
-                                ((self.spriteScanline[i][OAM_L.id] & 0x01) << 12) | 
-                                (((self.spriteScanline[i][OAM_L.id] & 0xFE) + 1) << 4) | 
-                                ((self.scanline - self.spriteScanline[i][OAM_L.y]) & 0x07))
-                    else:
-                        if self.scanline - self.spriteScanline[i][OAM_L.y] < 8:
-                            sprite_pattern_addr_lo = u16(
-                                ((self.spriteScanline[i][OAM_L.id] & 0x01) << 12) | 
-                                (((self.spriteScanline[i][OAM_L.id] & 0xFE) + 1) << 4) | 
-                                ((7 - (self.scanline - self.spriteScanline[i][OAM_L.y])) & 0x07))
-                        else:
-                            sprite_pattern_addr_lo = u16(
-                                ((self.spriteScanline[i][OAM_L.id] & 0x01) << 12) | 
-                                ((self.spriteScanline[i][OAM_L.id] & 0xFE) << 4) | 
-                                ((7 - (self.scanline - self.spriteScanline[i][OAM_L.y])) & 0x07))
-                sprite_pattern_addr_hi = u16(sprite_pattern_addr_lo + 8)
-                sprite_pattern_bits_lo = self.ppuRead(sprite_pattern_addr_lo)
-                sprite_pattern_bits_hi = self.ppuRead(sprite_pattern_addr_hi)
-                if self.spriteScanline[i][OAM_L.attribute] & 0x40:
-                    sprite_pattern_bits_lo = flipbyte(sprite_pattern_bits_lo)
-                    sprite_pattern_bits_hi = flipbyte(sprite_pattern_bits_hi)
-                self.sprite_shifter_pattern_lo[i] = sprite_pattern_bits_lo
-                self.sprite_shifter_pattern_hi[i] = sprite_pattern_bits_hi
+            self.fetch_sprites()
         if self.scanline == 240:
             pass
 
@@ -477,66 +613,65 @@ class PPU(Device):
                 if self.control & CONTROL_FLAG.enable_nmi:
                     self.nmi = True
 
-        bg_pixel = 0
-        bg_palette = 0
-        if self.mask & MASK_FLAG.render_background:
-            if (self.mask & MASK_FLAG.render_background_left) or (self.cycle >= 9):
-                bit_mux = 0x8000 >> self.fine_x
-                p0_pixel = int((self.bg_shifter_pattern_lo & bit_mux) > 0)
-                p1_pixel = int((self.bg_shifter_pattern_hi & bit_mux) > 0)
-                bg_pixel = (p1_pixel << 1) | p0_pixel
-                bg_pal0 = int((self.bg_shifter_attrib_lo & bit_mux) > 0)
-                bg_pal1 = int((self.bg_shifter_attrib_hi & bit_mux) > 0)
-                bg_palette = (bg_pal1 << 1) | bg_pal0
-
-        fg_pixel = 0x00
-        fg_palette = 0x00
-        fg_priority = 0x00
-        if self.mask & MASK_FLAG.render_sprites:
-            if (self.mask & MASK_FLAG.render_sprites_left) or (self.cycle >= 9):
-                self.bSpriteZeroBeingRendered = False
-                for i in range(self.sprite_count):
-                    if self.spriteScanline[i][OAM_L.x] == 0:
-                        fg_pixel_lo = (self.sprite_shifter_pattern_lo[i] & 0x80) > 0
-                        fg_pixel_hi = (self.sprite_shifter_pattern_hi[i] & 0x80) > 0
-                        fg_pixel = (fg_pixel_hi << 1) | fg_pixel_lo
-
-                        fg_palette = (self.spriteScanline[i][OAM_L.attribute] & 0x03) + 0x04
-                        fg_priority = int((self.spriteScanline[i][OAM_L.attribute] & 0x20) == 0)
-
-                        if fg_pixel != 0:
-                            if i == 0:
-                                self.bSpriteZeroBeingRendered = True
-                            break
-        pixel = 0
-        palette = 0
-        if bg_pixel == 0 and fg_pixel == 0:
-            pixel = 0x00
-            palette = 0x00
-        elif bg_pixel == 0 and fg_pixel > 0:
-            pixel = fg_pixel
-            palette = fg_palette
-        elif bg_pixel > 0 and fg_pixel == 0:
-            pixel = bg_pixel
-            palette = bg_palette
-        elif bg_pixel > 0 and fg_pixel > 0:
-            if fg_priority:
+        # skipped frames only need the pixels that can hit sprite 0
+        if self.draw_pixels or self.bSpriteZeroHitPossible:
+            bg_pixel = 0
+            bg_palette = 0
+            if self.mask & MASK_FLAG.render_background:
+                if (self.mask & MASK_FLAG.render_background_left) or (self.cycle >= 9):
+                    bit_mux = 0x8000 >> self.fine_x
+                    p0_pixel = int((self.bg_shifter_pattern_lo & bit_mux) > 0)
+                    p1_pixel = int((self.bg_shifter_pattern_hi & bit_mux) > 0)
+                    bg_pixel = (p1_pixel << 1) | p0_pixel
+                    bg_pal0 = int((self.bg_shifter_attrib_lo & bit_mux) > 0)
+                    bg_pal1 = int((self.bg_shifter_attrib_hi & bit_mux) > 0)
+                    bg_palette = (bg_pal1 << 1) | bg_pal0
+
+            fg_pixel = 0x00
+            fg_palette = 0x00
+            fg_priority = 0x00
+            if self.mask & MASK_FLAG.render_sprites:
+                if (self.mask & MASK_FLAG.render_sprites_left) or (self.cycle >= 9):
+                    self.bSpriteZeroBeingRendered = False
+                    # sprites move along the line up to cycle 257 and stand still
+                    # during vblank, only cycles 1 to 256 can show or hit them
+                    if 1 <= self.cycle <= 256:
+                        sprite = self.sprite_pixels[self.cycle - 1 if self.scanline < 240 else 0]
+                        if sprite:
+                            fg_pixel = sprite & 0x03
+                            fg_palette = (sprite >> 2) & 0x07
+                            fg_priority = int(sprite & 0x20 > 0)
+                            self.bSpriteZeroBeingRendered = sprite & 0x40 > 0
+            pixel = 0
+            palette = 0
+            if bg_pixel == 0 and fg_pixel == 0:
+                pixel = 0x00
+                palette = 0x00
+            elif bg_pixel == 0 and fg_pixel > 0:
                 pixel = fg_pixel
                 palette = fg_palette
-            else:
+            elif bg_pixel > 0 and fg_pixel == 0:
                 pixel = bg_pixel
                 palette = bg_palette
-            if self.bSpriteZeroHitPossible and self.bSpriteZeroBeingRendered:
-                if self.mask & MASK_FLAG.render_background and self.mask & MASK_FLAG.render_sprites:
-                    if not (self.mask & MASK_FLAG.render_background_left | self.mask & MASK_FLAG.render_sprites_left):
-                        if self.cycle >= 9 and self.cycle < 258:
-                            self.status |= STATUS_FLAG.sprite_zero_hit
-                    else:
-                        if self.cycle >= 1 and self.cycle < 258:
-                            self.status |= STATUS_FLAG.sprite_zero_hit
+            elif bg_pixel > 0 and fg_pixel > 0:
+                if fg_priority:
+                    pixel = fg_pixel
+                    palette = fg_palette
+                else:
+                    pixel = bg_pixel
+                    palette = bg_palette
+                if self.bSpriteZeroHitPossible and self.bSpriteZeroBeingRendered:
+                    if self.mask & MASK_FLAG.render_background and self.mask & MASK_FLAG.render_sprites:
+                        if not (self.mask & MASK_FLAG.render_background_left | self.mask & MASK_FLAG.render_sprites_left):
+                            if self.cycle >= 9 and self.cycle < 258:
+                                self.status |= STATUS_FLAG.sprite_zero_hit
+                        else:
+                            if self.cycle >= 1 and self.cycle < 258:
+                                self.status |= STATUS_FLAG.sprite_zero_hit
         # if bg_palette > 0 or bg_pixel > 0:
         #     print(f'x={self.cycle - 1}, y={self.scanline}, palette={palette}, pixel={pixel}')
-        self.engine.set_pixel(self.cycle - 1, self.scanline, self.GetColourFromPaletteRam(palette, pixel))
+        if self.draw_pixels and 0 <= self.scanline < 240 and 1 <= self.cycle <= 256:
+            self.sprScreen[self.scanline * 256 + self.cycle - 1] = self.tblPalette[PALETTE_FOLD[(palette << 2) | pixel]] & 0x3F
 
         self.cycle += 1
 
@@ -548,13 +683,222 @@ class PPU(Device):
             self.cycle = 0
             self.scanline += 1
             if self.scanline >= 261:
-                self.engine.update()
-                self.scanline = -1
-                self.n_frame += 1
-                self.frame_complete = True
-                self.odd_frame = not self.odd_frame
+                self.end_frame()
+
+    def end_frame(self) -> None:
+        if self.draw_pixels:
+            self.engine.present(self.frame_rgb())
+            self.frames_rendered += 1
+            self.frame_requested = False
+        else:
+            self.engine.update()
+            self.frames_skipped += 1
+        self.scanline = -1
+        self.n_frame += 1
+        self.frame_complete = True
+        self.odd_frame = not self.odd_frame
+        self.plan_frame()
+
+    def plan_frame(self) -> None:
+        # decides at the start of a frame whether it is drawn
+        self.draw_pixels = self.engine.draws and bool(
+            self.frame_requested or (self.render_every and self.n_frame % self.render_every == 0))
+
+    def request_frame(self) -> None:
+        # draw the next frame whatever render_every says
+        self.frame_requested = True
+        if self.scanline == -1 and self.cycle == 0:
+            self.plan_frame()
+
+    def fetch_tile(self, v: int, tile_id: int) -> Tuple[int, int, int, bytes]:
+        # lsb, msb and attribute of a background tile row, and its decoded
+        # pixels when the tile comes from the cartridge's tile cache
+        attrib = self.ppuRead(0x23C0 | (v & 0x0C00) | ((v >> 4) & 0x38) | ((v >> 2) & 0x07))
+        if v & 0x40:
+            attrib >>= 4
+        if v & 0x02:
+            attrib >>= 2
+        row = (v & LOOPY_FLAG.fine_y) >> 12
+        index = self.chr_tiles[((self.control & CONTROL_FLAG.pattern_background) << 4) | tile_id] if self.chr_tiles else None
+        if index is not None:
+            tile = self.cartridge.tile(index)
+            return tile.planes[row], tile.planes[row + 8], attrib & 0x03, tile.pixels[row]
+        addr = ((self.control & CONTROL_FLAG.pattern_background) << 8) + (tile_id << 4) + row
+        return self.ppuRead(addr), self.ppuRead(addr + 8), attrib & 0x03, None
+
+    def render_line(self) -> int:
+        # Runs a whole scanline from cycle 0 in one go and returns the clocks it
+        # took. The end state matches clock(): the background pipeline is done a
+        # tile at a time, pixels come from the row of fetched tiles, and sprites
+        # from the row the previous line evaluated.
+        scanline = self.scanline
+        mask = self.mask
+        rendering = mask & (MASK_FLAG.render_background | MASK_FLAG.render_sprites)
+        show_bg = mask & MASK_FLAG.render_background
+        show_sp = mask & MASK_FLAG.render_sprites
+        ticks = 340 if scanline == 0 and self.odd_frame and rendering else 341
+        if scanline < 240:
+            if scanline == -1:
+                self.status &= ~(STATUS_FLAG.vertical_blank | STATUS_FLAG.sprite_overflow | STATUS_FLAG.sprite_zero_hit)
+                self.sprite_shifter_pattern_lo = bytearray(8)
+                self.sprite_shifter_pattern_hi = bytearray(8)
+                self.sprite_pixels = NO_SPRITES
+            read = self.ppuRead
+            v = self.vram_addr
+            shifters = (self.bg_shifter_pattern_lo, self.bg_shifter_pattern_hi,
+                        self.bg_shifter_attrib_lo, self.bg_shifter_attrib_hi)
+            # cycles 2 to 257: 32 tiles, the first one named by the previous line
+            tiles = []
+            tile_id = self.bg_next_tile_id
+            for k in range(32):
+                if k:
+                    tile_id = read(0x2000 | (v & 0x0FFF))
+                tiles.append(self.fetch_tile(v, tile_id))
+                if rendering:
+                    v = v + 1 if v & 0x1F != 31 else (v & ~0x1F) ^ 0x0400
+            if scanline >= 0 and (self.draw_pixels or self.bSpriteZeroHitPossible):
+                self.draw_line(shifters, tiles)
+            elif show_sp:
+                for i in range(self.sprite_count):
+                    self.spriteScanline[i * 4 + OAM_L.x] = 0
+            if rendering:
+                if v & 0x7000 != 0x7000:
+                    v += 0x1000
+                else:
+                    v &= ~0x7000
+                    if v & 0x03E0 == 29 << 5:
+                        v = (v & ~0x03E0) ^ 0x0800
+                    elif v & 0x03E0 == 31 << 5:
+                        v &= ~0x03E0
+                    else:
+                        v += 1 << 5
+            if rendering:
+                v = set_flag(v, self.tram_addr, LOOPY_FLAG.nametable_x | LOOPY_FLAG.coarse_x)
+            if scanline >= 0:
+                self.evaluate_sprites()
+            elif rendering:
+                v = set_flag(v, self.tram_addr, LOOPY_FLAG.nametable_y | LOOPY_FLAG.coarse_y | LOOPY_FLAG.fine_y)
+            # the shifters after cycle 257, then cycles 321 to 337 load them with
+            # the last tile and prefetch the first two of the next line
+            last = tiles[31]
+            if show_bg:
+                loaded = [(high << 8) | low for high, low in zip(tile_bytes(tiles[30]), tile_bytes(last))]
+            else:
+                loaded = [(shifter & 0xFF00) | low for shifter, low in zip(shifters, tile_bytes(last))]
+            for n, shift in enumerate((1, 8, 8)):
+                if show_bg:
+                    loaded = [(shifter << shift) & 0xFFFF for shifter in loaded]
+                loaded = [(shifter & 0xFF00) | low for shifter, low in zip(loaded, tile_bytes(last))]
+                tile_id = read(0x2000 | (v & 0x0FFF))
+                if n < 2:
+                    last = self.fetch_tile(v, tile_id)
+                    if rendering:
+                        v = v + 1 if v & 0x1F != 31 else (v & ~0x1F) ^ 0x0400
+            self.vram_addr = v
+            self.bg_next_tile_id = tile_id
+            self.bg_next_tile_lsb, self.bg_next_tile_msb, self.bg_next_tile_attrib = last[:3]
+            (self.bg_shifter_pattern_lo, self.bg_shifter_pattern_hi,
+             self.bg_shifter_attrib_lo, self.bg_shifter_attrib_hi) = loaded
+        else:
+            if scanline == 241:
+                self.status |= STATUS_FLAG.vertical_blank
+                if self.control & CONTROL_FLAG.enable_nmi:
+                    self.nmi = True
+            # nothing shifts here, so sprite 0 hits from cycle 9 on or not at all
+            if self.bSpriteZeroHitPossible and show_bg and show_sp:
+                bit = 15 - self.fine_x
+                if ((self.bg_shifter_pattern_lo | self.bg_shifter_pattern_hi) >> bit) & 1 and self.sprite_pixels[0] & 0x40:
+                    self.status |= STATUS_FLAG.sprite_zero_hit
+            self.evaluate_sprites()
+        self.fetch_sprites()
+        if rendering and scanline < 240:
+            self.cartridge.mapper.scanline()
+        self.cycle = 0
+        self.scanline += 1
+        if self.scanline >= 261:
+            self.end_frame()
+        return ticks
+
+    def draw_line(self, shifters: Tuple[int, int, int, int], tiles: List[Tuple[int, int, int, bytes]]) -> None:
+        mask = self.mask
+        # palette << 2 | pixel for the two tiles in the shifters and the fetched
+        # ones after them, 0 where transparent
+        bg = [0] * 264
+        if mask & MASK_FLAG.render_background:
+            pattern_lo, pattern_hi, attrib_lo, attrib_hi = shifters
+            for j in range(16):
+                bit = 15 - j
+                pixel = ((pattern_hi >> bit) & 1) << 1 | ((pattern_lo >> bit) & 1)
+                if pixel:
+                    bg[j] = (((attrib_hi >> bit) & 1) << 3) | (((attrib_lo >> bit) & 1) << 2) | pixel
+            j = 16
+            for lsb, msb, attrib, pixels in tiles[:31]:
+                if lsb | msb:
+                    if pixels is None:
+                        pixels = [((msb >> bit) & 1) << 1 | ((lsb >> bit) & 1) for bit in range(7, -1, -1)]
+                    colour = attrib << 2
+                    bg[j:j + 8] = [colour | pixel if pixel else 0 for pixel in pixels]
+                j += 8
+            bg = bg[self.fine_x:self.fine_x + 256]
+            if not mask & MASK_FLAG.render_background_left:
+                bg[:8] = [0] * 8
+        else:
+            bg = bg[:256]
+        # the same for sprites, see sprite_row()
+        fg = NO_SPRITES
+        if mask & MASK_FLAG.render_sprites:
+            fg = self.sprite_pixels
+            if not mask & MASK_FLAG.render_sprites_left:
+                fg = NO_SPRITES[:8] + fg[8:]
+        hit = self.bSpriteZeroHitPossible and mask & MASK_FLAG.render_background and mask & MASK_FLAG.render_sprites
+        first_hit = 0 if mask & (MASK_FLAG.render_background_left | MASK_FLAG.render_sprites_left) else 8
+        line = bg
+        if any(fg):
+            line = []
+            for x in range(256):
+                b = bg[x]
+                f = fg[x]
+                if f:
+                    if b:
+                        if f & 0x40 and hit and x >= first_hit:
+                            self.status |= STATUS_FLAG.sprite_zero_hit
+                        line.append(f & 0x1F if f & 0x20 else b)
+                    else:
+                        line.append(f & 0x1F)
+                else:
+                    line.append(b)
+        if self.draw_pixels:
+            colours = bytes(self.tblPalette[i] & 0x3F for i in PALETTE_FOLD).ljust(256, b'\0')
+            self.sprScreen[self.scanline * 256:(self.scanline + 1) * 256] = bytes(line).translate(colours)
 
-    def GetPatternTable(self, i:int, palette:int) -> int:
+    def run(self, ticks: int) -> None:
+        clock = self.clock
+        if self.line_renderer and not self.observers:
+            while ticks >= 341:
+                if self.cycle:
+                    n = 341 - self.cycle
+                    ticks -= n
+                    for _ in range(n):
+                        clock()
+                else:
+                    ticks -= self.render_line()
+        for _ in range(ticks):
+            clock()
+
+    def ticks_until(self, scanline: int, cycle: int) -> int:
+        # clocks before the one at scanline, cycle; may be one early on odd
+        # frames where cycle 0 of scanline 0 is skipped
+        position = (self.scanline + 1) * 341 + self.cycle
+        return ((scanline + 1) * 341 + cycle - position) % (262 * 341)
+
+    def ticks_until_vblank(self) -> int:
+        # vblank and NMI are raised at scanline 241, cycle 1
+        return self.ticks_until(241, 1)
+
+    def GetPatternTable(self, i:int, palette:int) -> memoryview:
+        if np is not None:
+            self.sprPatternTable[i * 128 * 128 * 3:(i + 1) * 128 * 128 * 3] = self.pattern_table_rgb(i, palette).tobytes()
+            return memoryview(self.sprPatternTable)[i * 128 * 128 * 3:(i + 1) * 128 * 128 * 3]
         for nTileY in range(16):
             for nTileX in range(16):
                 nOffset = nTileY * 256 + nTileX * 16
@@ -562,12 +906,106 @@ class PPU(Device):
                     tile_lsb = self.ppuRead(i * 0x1000 + nOffset + row + 0x0000)
                     tile_msb = self.ppuRead(i * 0x1000 + nOffset + row + 0x0008)
                     for col in range(8):
-                        pixel = (tile_lsb & 0x01) + (tile_msb & 0x01)
+                        pixel = (tile_msb & 0x01) << 1 | (tile_lsb & 0x01)
                         tile_lsb >>= 1
                         tile_msb >>= 1
-                        self.sprPatternTable[i][nTileX * 8 + (7 - col)][nTileY * 8 + row] = self.GetColourFromPaletteRam(palette, pixel)
-        return self.sprPatternTable[i]
+                        index = ((i * 128 + nTileY * 8 + row) * 128 + nTileX * 8 + (7 - col)) * 3
+                        self.sprPatternTable[index:index + 3] = bytes(self.GetColourFromPaletteRam(palette, pixel))
+        return memoryview(self.sprPatternTable)[i * 128 * 128 * 3:(i + 1) * 128 * 128 * 3]
     
+    def pattern_bytes(self, i: int) -> bytes:
+        # the 4 KiB of pattern table i, straight from CHR memory where the
+        # cartridge maps it
+        if self.cartridge is None:
+            return bytes(self.tblPattern[i * 0x1000:(i + 1) * 0x1000])
+        if not self.chr_tiles:
+            return bytes(self.ppuRead(addr) for addr in range(i * 0x1000, (i + 1) * 0x1000))
+        memory = self.cartridge.vCHRMemory
+        indices = self.chr_tiles[i * 256:(i + 1) * 256]
+        if None not in indices and indices == list(range(indices[0], indices[0] + 256)):
+            return bytes(memory[indices[0] << 4:(indices[0] + 256) << 4])
+        return b''.join(bytes(memory[index << 4:(index + 1) << 4]) if index is not None else
+                        bytes(self.ppuRead(addr) for addr in range((i << 12) | (tile << 4), (i << 12) | (tile << 4) + 16))
+                        for tile, index in enumerate(indices))
+
+    def pattern_pixels(self, i: int) -> 'np.ndarray':
+        # the 256 tiles of pattern table i as 8x8 arrays of 2-bit pixels
+        planes = np.frombuffer(self.pattern_bytes(i), np.uint8).reshape(256, 2, 8)
+        bits = np.unpackbits(planes, axis=2).reshape(256, 2, 8, 8)
+        return bits[:, 0] | (bits[:, 1] << 1)
+
+    def palette_rgb(self, colours: 'np.ndarray') -> 'np.ndarray':
+        # RGB of palette << 2 | pixel values, read through the palette RAM mirrors
+        table = rgb_table(self.mask & (MASK_FLAG.grayscale | MASK_FLAG.enhance_red | MASK_FLAG.enhance_green | MASK_FLAG.enhance_blue))
+        palette = np.array([self.tblPalette[i] & 0x3F for i in PALETTE_FOLD], np.uint8)
+        return np.frombuffer(table, np.uint8).reshape(64, 3)[palette[colours]]
+
+    def pattern_table_rgb(self, i: int, palette: int) -> 'np.ndarray':
+        # pattern table i as a 128x128 RGB image in the given palette
+        if np is None:
+            raise RuntimeError('the PPU viewers need numpy installed')
+        pixels = self.pattern_pixels(i).reshape(16, 16, 8, 8).transpose(0, 2, 1, 3).reshape(128, 128)
+        return self.palette_rgb((palette << 2) | pixels)
+
+    def nametables_rgb(self) -> 'np.ndarray':
+        # the four nametables as a 480x512 RGB image, laid out as they are
+        # addressed, with transparent pixels in the backdrop colour
+        if np is None:
+            raise RuntimeError('the PPU viewers need numpy installed')
+        tiles = self.pattern_pixels(int(self.control & CONTROL_FLAG.pattern_background > 0))
+        ty, tx = np.mgrid[0:30, 0:32]
+        image = np.zeros((480, 512), np.uint8)
+        for n, (memory, offset) in enumerate(self.name_pages):
+            table = np.frombuffer(bytes(memory[offset:offset + 1024]), np.uint8)
+            attrib = table[960:][(ty >> 2) * 8 + (tx >> 2)]
+            palette = (attrib >> (((ty & 2) << 1) | (tx & 2))) & 0x03
+            pixels = tiles[table[:960].reshape(30, 32)]
+            pixels = np.where(pixels, pixels | (palette << 2)[:, :, None, None], 0)
+            image[(n >> 1) * 240:(n >> 1) * 240 + 240, (n & 1) * 256:(n & 1) * 256 + 256] = \
+                pixels.transpose(0, 2, 1, 3).reshape(240, 256)
+        return self.palette_rgb(image)
+
+    def sprites_rgb(self) -> 'np.ndarray':
+        # the 64 OAM sprites in an 8x8 grid, 8 pixels wide and 8 or 16 high
+        if np is None:
+            raise RuntimeError('the PPU viewers need numpy installed')
+        oam = np.frombuffer(bytes(self.OAM), np.uint8).reshape(64, 4)
+        ids, attributes = oam[:, OAM_L.id], oam[:, OAM_L.attribute]
+        if self.control & CONTROL_FLAG.sprite_size:
+            tables = [self.pattern_pixels(0), self.pattern_pixels(1)]
+            top = np.where((ids & 1)[:, None, None], tables[1][ids & 0xFE], tables[0][ids & 0xFE])
+            bottom = np.where((ids & 1)[:, None, None], tables[1][(ids & 0xFE) + 1], tables[0][(ids & 0xFE) + 1])
+            sprites = np.concatenate([top, bottom], axis=1)
+        else:
+            sprites = self.pattern_pixels(int(self.control & CONTROL_FLAG.pattern_sprite > 0))[ids]
+        sprites = np.where((attributes & 0x40)[:, None, None] > 0, sprites[:, :, ::-1], sprites)
+        sprites = np.where((attributes & 0x80)[:, None, None] > 0, sprites[:, ::-1, :], sprites)
+        sprites = np.where(sprites, sprites | (0x10 | ((attributes & 0x03) << 2))[:, None, None], 0)
+        height = sprites.shape[1]
+        return self.palette_rgb(sprites.reshape(8, 8, height, 8).transpose(0, 2, 1, 3).reshape(8 * height, 64))
+
+    def frame_rgb(self) -> bytes:
+        # the screen as 256x240 RGB bytes, converted once a frame
+        table = rgb_table(self.mask & (MASK_FLAG.grayscale | MASK_FLAG.enhance_red | MASK_FLAG.enhance_green | MASK_FLAG.enhance_blue))
+        if np is not None:
+            return np.frombuffer(table, np.uint8).reshape(64, 3)[np.frombuffer(self.sprScreen, np.uint8)].tobytes()
+        rgb = bytearray(len(self.sprScreen) * 3)
+        for channel in range(3):
+            rgb[channel::3] = self.sprScreen.translate(table[channel::3].ljust(256, b'\0'))
+        return bytes(rgb)
+
+    def pack_state(self) -> bytes:
+        # the pixels of the fetched sprites go along, the line being drawn may
+        # still need them after the next line's sprites were evaluated
+        return super().pack_state() + bytes(self.sprite_pixels)
+
+    def check_state(self, data: bytes) -> None:
+        super().check_state(data[:-len(NO_SPRITES)])
+
+    def unpack_state(self, data: bytes) -> None:
+        super().unpack_state(data[:-len(NO_SPRITES)])
+        self.sprite_pixels = bytes(data[-len(NO_SPRITES):])
+
     def GetColourFromPaletteRam(self, palette, pixel):
         return self.palScreen[self.ppuRead(0x3F00 + (palette << 2) + pixel) & 0x3F]
 
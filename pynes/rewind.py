@@ -0,0 +1,98 @@
+import time
+import zlib
+from collections import deque, namedtuple
+
+# default memory budget of a rewind buffer, and how many delta snapshots
+# share a keyframe
+REWIND_BUDGET = 32 * 1024 * 1024
+KEYFRAME_EVERY = 120
+
+
+def xor_bytes(a: bytes, b: bytes) -> bytes:
+    # bytes of a that match b come out as zeros, which zlib packs into a few bytes
+    return (int.from_bytes(a, 'little') ^ int.from_bytes(b, 'little')).to_bytes(len(a), 'little')
+
+
+class RewindStats(namedtuple('RewindStats', 'snapshots size captures seconds')):
+    # what a rewind buffer holds and what capturing it cost
+    @property
+    def per_capture(self) -> float:
+        return self.seconds / self.captures if self.captures else 0.0
+
+
+class Rewind:
+    # Ring buffer of save states for stepping a Bus backwards. Once attached,
+    # Bus.run_frames() calls frame_done() after each frame and every interval
+    # frames a snapshot is captured. A keyframe is stored compressed and the
+    # snapshots after it as compressed XOR deltas against it, up to
+    # keyframe_every of them; when the buffer outgrows budget bytes the oldest
+    # keyframe goes together with its deltas.
+    def __init__(self, bus, interval: int = 1, budget: int = REWIND_BUDGET, keyframe_every: int = KEYFRAME_EVERY):
+        for name, value in (('interval', interval), ('budget', budget), ('keyframe_every', keyframe_every)):
+            if value < 1:
+                raise ValueError(f'{name} must be at least 1, got {value}')
+        self.bus = bus
+        self.interval = interval
+        self.budget = budget
+        self.keyframe_every = keyframe_every
+        # (keyframe, deltas) oldest first, and the newest keyframe uncompressed
+        self.groups = deque()
+        self.key = None
+        self.size = 0
+        self.frames = 0
+        self.captures = 0
+        self.seconds = 0.0
+        bus.rewind = self
+
+    def __len__(self) -> int:
+        return sum(1 + len(deltas) for _, deltas in self.groups)
+
+    def frame_done(self) -> None:
+        self.frames += 1
+        if self.frames % self.interval == 0:
+            self.capture()
+
+    def capture(self) -> None:
+        ts = time.perf_counter()
+        state = self.bus.save_state()
+        if self.key is None or len(state) != len(self.key) or len(self.groups[-1][1]) >= self.keyframe_every:
+            data = zlib.compress(state, 1)
+            self.groups.append((data, []))
+            self.key = state
+        else:
+            data = zlib.compress(xor_bytes(state, self.key), 1)
+            self.groups[-1][1].append(data)
+        self.size += len(data)
+        # the newest group stays even if it alone is over budget
+        while self.size > self.budget and len(self.groups) > 1:
+            key, deltas = self.groups.popleft()
+            self.size -= len(key) + sum(map(len, deltas))
+        self.captures += 1
+        self.seconds += time.perf_counter() - ts
+
+    def pop(self) -> bytes:
+        # removes the newest snapshot and returns its save state
+        key, deltas = self.groups[-1]
+        if deltas:
+            data = deltas.pop()
+            state = xor_bytes(zlib.decompress(data), self.key)
+        else:
+            data = key
+            state = self.key
+            self.groups.pop()
+            self.key = zlib.decompress(self.groups[-1][0]) if self.groups else None
+        self.size -= len(data)
+        return state
+
+    def rewind(self, snapshots: int = 1) -> None:
+        # goes back to the snapshot captured that many captures ago, it and the
+        # newer ones are dropped so that the next call goes further back
+        if not 0 < snapshots <= len(self):
+            raise ValueError(f'cannot rewind {snapshots} of {len(self)} snapshots')
+        for _ in range(snapshots - 1):
+            self.pop()
+        self.bus.load_state(self.pop())
+        self.frames = 0
+
+    def stats(self) -> RewindStats:
+        return RewindStats(len(self), self.size, self.captures, self.seconds)
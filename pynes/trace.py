@@ -0,0 +1,50 @@
+from collections import namedtuple
+from typing import Callable, List
+
+Access = namedtuple('Access', 'addr value kind cycle')
+
+READ = 'read'
+WRITE = 'write'
+PPU_READ = 'ppu_read'
+PPU_WRITE = 'ppu_write'
+
+Observer = Callable[[List[Access]], None]
+
+
+class Traceable:
+    # Devices install traced versions of their access methods only while an
+    # observer is attached, so an untraced device pays nothing for this.
+    def init_trace(self) -> None:
+        self.observers = []
+        self.trace_buffer = []
+        self.trace_batch = 0
+
+    def add_observer(self, observer: Observer, batch_size: int = 1024) -> None:
+        self.flush_observers()
+        self.observers.append((observer, batch_size))
+        self.trace_batch = min(size for _, size in self.observers)
+        self.install_trace(True)
+
+    def remove_observer(self, observer: Observer) -> None:
+        if not any(o == observer for o, _ in self.observers):
+            return
+        self.flush_observers()
+        self.observers = [(o, size) for o, size in self.observers if o != observer]
+        self.trace_batch = min((size for _, size in self.observers), default=0)
+        if not self.observers:
+            self.install_trace(False)
+
+    def flush_observers(self) -> None:
+        if self.trace_buffer:
+            batch = self.trace_buffer
+            self.trace_buffer = []
+            for observer, _ in self.observers:
+                observer(batch)
+
+    def record(self, addr: int, value: int, kind: str, cycle: int) -> None:
+        self.trace_buffer.append(Access(addr, value, kind, cycle))
+        if len(self.trace_buffer) >= self.trace_batch:
+            self.flush_observers()
+
+    def install_trace(self, enabled: bool) -> None:
+        raise NotImplementedError
@@ -0,0 +1,339 @@
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from pynes.bits import is_checked, set_checked
+from pynes.bus import Bus, FRAME_TICKS, STATE_HEADER, STATE_SECTION
+from pynes.cartridge import Cartridge, PRG_PATCH
+from pynes.cpu import CPU
+from pynes.engine import NullEngine
+from pynes.ppu import PPU
+from pynes.trace import READ, WRITE
+
+ROMS = Path(__file__).resolve().parent.parent / 'roms'
+
+
+class TestBusMethods(unittest.TestCase):
+    def setUp(self):
+        self.bus = Bus()
+        self.bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+
+    def testRamMirror(self):
+        self.bus.write(0x0802, 0x5A)
+        self.assertEqual(self.bus.read(0x0002), 0x5A)
+        self.assertEqual(self.bus.read(0x1802), 0x5A)
+        self.assertEqual(self.bus.cpuRam[0x0002], 0x5A)
+
+    def testPrgPages(self):
+        prg = self.bus.cartridge.vPRGMemory
+        memory, offset = self.bus.read_pages[0xC1]
+        self.assertIs(memory, prg)
+        self.assertEqual(self.bus.read(0x8123), prg[0x0123])
+        self.assertEqual(self.bus.read(0xC123), prg[0x0123])
+        self.assertEqual(self.bus.read(0xFFFC), self.bus.cartridge.read(0xFFFC))
+
+    def testBankSwitchNotifies(self):
+        self.bus.connect_cartridge(Cartridge(str(ROMS / 'Tetris (USA) (Tengen) (Unl).nes')))
+        calls = []
+        mapper = self.bus.cartridge.mapper
+        mapper.add_listener(lambda: calls.append(mapper.nCHRBankSelect))
+        # a CHR switch leaves the CPU's pages alone
+        mapper.add_listener(lambda: calls.append('cpu'), ppu=False)
+        self.bus.write(0x8000, 0x01)
+        self.bus.write(0x8000, 0x01)
+        self.assertEqual(calls, [1])
+        mapper.notify()
+        self.assertEqual(calls, [1, 1, 'cpu'])
+
+    def testBulkDma(self):
+        self.bus.ppu = SimpleNamespace(OAM=bytearray(256))
+        for i in range(256):
+            self.bus.write(0x0200 + i, i)
+        self.bus.nSystemClockCounter = 3
+        self.bus.write(0x4014, 0x02)
+        self.assertEqual(self.bus.ppu.OAM, bytearray(range(256)))
+        self.assertTrue(self.bus.dma_transfer)
+        self.assertEqual(self.bus.dma_stall, 514)
+
+    def testIdleSkip(self):
+        buses = []
+        for idle_skip in (True, False):
+            bus = Bus(idle_skip=idle_skip, video='null')
+            bus.connect(CPU())
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+            bus.reset()
+            target = buses[0].nSystemClockCounter if buses else 200000
+            while bus.nSystemClockCounter < target:
+                bus.step()
+            buses.append(bus)
+        self.assertGreater(buses[0].idle_cycles, 0)
+        self.assertEqual(buses[1].idle_cycles, 0)
+        skipped, stepped = [(bus.nSystemClockCounter, bus.cpu.clock_count, bus.cpu.pc, bus.cpu.a, bus.cpu.x,
+                             bus.cpu.y, bus.cpu.status, bus.ppu.scanline, bus.ppu.cycle, bus.cpuRam)
+                            for bus in buses]
+        self.assertEqual(skipped, stepped)
+
+    def testIdleSkipStopsAtLimit(self):
+        states = []
+        for idle_skip in (True, False):
+            bus = Bus(idle_skip=idle_skip, video='null')
+            bus.connect(CPU())
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+            bus.reset()
+            target = 3 * FRAME_TICKS
+            while bus.nSystemClockCounter < target:
+                bus.step(target - bus.nSystemClockCounter)
+            self.assertEqual(bus.idle_cycles > 0, idle_skip)
+            states.append((bus.nSystemClockCounter, bus.save_state()))
+        self.assertLess(states[0][0] - target, 3 * 8)
+        self.assertEqual(states[0], states[1])
+
+    def testCatchUpMatchesPerInstruction(self):
+        buses, nmis = [], []
+        for catch_up in (True, False):
+            bus = Bus(catch_up=catch_up, video='null')
+            bus.connect(CPU())
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+            bus.reset()
+            taken = []
+
+            def nmi(bus=bus, taken=taken, nmi=bus.cpu.nmi):
+                # when the CPU takes NMI, by the master clock, its own clock and the PPU dot
+                taken.append((bus.nSystemClockCounter, bus.cpu.clock_count, bus.ppu.scanline, bus.ppu.cycle))
+                nmi()
+            bus.cpu.nmi = nmi
+            while bus.nSystemClockCounter < 6 * FRAME_TICKS:
+                bus.step()
+            buses.append(bus)
+            nmis.append(taken)
+        self.assertGreaterEqual(len(nmis[0]), 2)
+        self.assertEqual(nmis[0], nmis[1])
+        self.assertEqual(buses[0].save_state(), buses[1].save_state())
+
+    def testBlocksMatchInterpreter(self):
+        buses = []
+        for blocks in (True, False):
+            bus = Bus(video='null')
+            bus.connect(CPU(blocks=blocks))
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'starter.nes')))
+            bus.reset()
+            target = buses[0].nSystemClockCounter if buses else 200000
+            while bus.nSystemClockCounter < target:
+                bus.step()
+            buses.append(bus)
+        self.assertTrue(buses[0].cpu.blocks)
+        translated, interpreted = [(bus.nSystemClockCounter, bus.cpu.clock_count, bus.cpu.pc, bus.cpu.a, bus.cpu.x,
+                                    bus.cpu.y, bus.cpu.status, bus.ppu.scanline, bus.ppu.cycle, bus.cpuRam)
+                                   for bus in buses]
+        self.assertEqual(translated, interpreted)
+
+    def testRamCodeInvalidation(self):
+        cpu = CPU(blocks=True)
+        self.bus.connect(cpu)
+        # LDA #$01; STA $0301; JMP $0300
+        for i, byte in enumerate([0xA9, 0x01, 0x8D, 0x01, 0x03, 0x4C, 0x00, 0x03]):
+            self.bus.write(0x0300 + i, byte)
+        cpu.pc = 0x0300
+        self.assertEqual(cpu.step_block(100), 9)
+        self.assertEqual((cpu.a, cpu.pc, self.bus.read(0x0301)), (0x01, 0x0300, 0x01))
+        self.bus.write(0x0301, 0x05)
+        cpu.step_block(100)
+        self.assertEqual(cpu.a, 0x05)
+
+    def testPrgWriteFlushesBlocks(self):
+        cpu = CPU(blocks=True)
+        self.bus.connect(cpu)
+        # LDA #$01; JMP $8000, written over NROM's PRG
+        for i, byte in enumerate([0xA9, 0x01, 0x4C, 0x00, 0x80]):
+            self.bus.write(0x8000 + i, byte)
+        cpu.pc = 0x8000
+        cpu.step_block(100)
+        self.assertEqual(cpu.a, 0x01)
+        self.bus.write(0x8001, 0x05)
+        cpu.step_block(100)
+        self.assertEqual(cpu.a, 0x05)
+
+    def testBlocksShowObserversEveryAccess(self):
+        traces = []
+        for blocks in (True, False):
+            bus = Bus(video='null')
+            bus.connect(CPU(blocks=blocks))
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'starter.nes')))
+            bus.reset()
+            accesses = []
+            bus.add_observer(lambda batch: accesses.extend((a.addr, a.value, a.kind) for a in batch))
+            bus.run_until(30000)
+            bus.flush_observers()
+            traces.append(accesses)
+        self.assertGreater(len(traces[0]), 1000)
+        self.assertEqual(traces[0], traces[1])
+
+    def testBlockReadsFlagsBeforeSettingThem(self):
+        # PHP; BIT $10; LDA #$01; PHP; JMP $0300
+        program = [0x08, 0x24, 0x10, 0xA9, 0x01, 0x08, 0x4C, 0x00, 0x03]
+        results = []
+        for blocks in (True, False):
+            bus = Bus()
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+            cpu = CPU(blocks=blocks)
+            bus.connect(cpu)
+            for i, byte in enumerate(program):
+                bus.write(0x0300 + i, byte)
+            bus.write(0x0010, 0xC0)
+            cpu.pc, cpu.stkp, cpu.a, cpu.status = 0x0300, 0xFD, 0x00, 0x80
+            if blocks:
+                cpu.step_block(100)
+            else:
+                for _ in range(5):
+                    cpu.step()
+            results.append((cpu.a, cpu.status, cpu.stkp, cpu.pc, bus.read(0x01FD), bus.read(0x01FC)))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][4] & 0x80, 0x80)
+
+    def testVideoBackend(self):
+        bus = Bus(video='null')
+        bus.connect(PPU(video='offscreen'))
+        self.assertFalse(bus.ppu.draw_pixels)
+        self.assertIsInstance(bus.ppu.engine, NullEngine)
+
+    def testRunLoops(self):
+        bus = Bus(video='null', catch_up=True)
+        bus.connect(CPU())
+        bus.connect(PPU())
+        bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+        bus.reset()
+        stats = bus.run_frames(2)
+        self.assertEqual(stats.frames, 2)
+        self.assertGreaterEqual(stats.ticks, 2 * FRAME_TICKS)
+        self.assertEqual(bus.ppu_lag, 0)
+        self.assertGreater(stats.fps, 0)
+        stats = bus.run_until(bus.nSystemClockCounter + 1000)
+        self.assertGreaterEqual(stats.ticks, 1000)
+        stats = bus.run_realtime(speed=1000, frames=1)
+        self.assertEqual(stats.frames, 1)
+        self.assertAlmostEqual(stats.clock_rate, stats.ticks / stats.seconds)
+
+    def testRunUntilStopsOnTime(self):
+        results = []
+        for idle_skip, blocks in ((False, False), (True, False), (False, True), (True, True)):
+            bus = Bus(video='null', catch_up=blocks, idle_skip=idle_skip)
+            bus.connect(CPU(blocks=blocks))
+            bus.connect(PPU())
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+            bus.reset()
+            bus.run_until(3 * FRAME_TICKS)
+            self.assertLess(bus.nSystemClockCounter - 3 * FRAME_TICKS, 3 * 8)
+            stats = bus.run_frames(2)
+            self.assertLess(stats.ticks - 2 * FRAME_TICKS, 3 * 8)
+            # translated blocks leave the CPU's scratch registers alone, so compare the rest
+            results.append((bus.nSystemClockCounter, bus.cpu.clock_count, bus.cpu.pc, bus.cpu.a, bus.cpu.x,
+                            bus.cpu.y, bus.cpu.status, bus.ppu.scanline, bus.ppu.cycle, bus.ppu.pack_state(),
+                            bus.cpuRam))
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def testSaveState(self):
+        bus = Bus(video='offscreen', catch_up=True)
+        bus.connect(CPU(blocks=True))
+        bus.connect(PPU())
+        bus.connect_cartridge(Cartridge(str(ROMS / 'starter.nes')))
+        bus.reset()
+        bus.run_frames(2)
+        bus.run_until(bus.nSystemClockCounter + 12345)
+        state = bus.save_state()
+        self.assertIsInstance(state, bytes)
+        bus.run_frames(3)
+        after, frame = bus.save_state(), bus.ppu.engine.frame
+        bus.load_state(state)
+        self.assertEqual(bus.save_state(), state)
+        bus.run_frames(3)
+        self.assertEqual(bus.save_state(), after)
+        self.assertEqual(bus.ppu.engine.frame, frame)
+        with self.assertRaises(ValueError):
+            bus.load_state(b'PYNS\x00\x00' + state[6:])
+        # a byte written over NROM's PRG goes along as a patch, the rest of the ROM does not
+        self.assertLess(len(state), len(bus.cartridge.vPRGMemory))
+        bus.write(0x8000, bus.read(0x8000) ^ 0xFF)
+        patched = bus.save_state()
+        self.assertEqual(len(patched), len(after) + PRG_PATCH.size)
+        bus.load_state(state)
+        self.assertEqual(bytes(bus.cartridge.vPRGMemory), bus.cartridge.prg_rom)
+        bus.load_state(patched)
+        self.assertEqual(bus.save_state(), patched)
+
+    def testLoadStateChecksFirst(self):
+        bus = Bus(video='null')
+        bus.connect(CPU())
+        bus.connect(PPU())
+        bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+        bus.reset()
+        bus.run_frames(1)
+        state = bus.save_state()
+        other = Bus(video='null')
+        other.connect(CPU())
+        other.connect(PPU())
+        other.connect_cartridge(Cartridge(str(ROMS / 'starter.nes')))
+        other.reset()
+        with self.assertRaises(ValueError):
+            bus.load_state(other.save_state())
+        # an odd byte on the cartridge section, behind the sections that would fit
+        sections = []
+        offset = STATE_HEADER.size
+        while offset < len(state):
+            size, = STATE_SECTION.unpack_from(state, offset)
+            sections.append(state[offset + STATE_SECTION.size:offset + STATE_SECTION.size + size])
+            offset += STATE_SECTION.size + size
+        sections[3] += b'\x00'
+        broken = state[:STATE_HEADER.size] + b''.join(STATE_SECTION.pack(len(s)) + s for s in sections)
+        bus.run_frames(1)
+        before = bus.save_state()
+        for bad in (broken, state[:-1], state[:10]):
+            with self.assertRaises(ValueError):
+                bus.load_state(bad)
+            self.assertEqual(bus.save_state(), before)
+
+    def testCheckedBuild(self):
+        checked = is_checked()
+        set_checked(True)
+        try:
+            bus = Bus()
+            bus.connect_cartridge(Cartridge(str(ROMS / 'helloworld.nes')))
+        finally:
+            set_checked(checked)
+        bus.write(0x0010, 0xFF)
+        self.assertEqual(bus.read(0x0010), 0xFF)
+        with self.assertRaises(AssertionError):
+            bus.write(0x0010, 0x100)
+        with self.assertRaises(AssertionError):
+            bus.read(0x10000)
+
+    def testObserver(self):
+        batches = []
+        self.bus.add_observer(batches.append, batch_size=2)
+        self.bus.write(0x0010, 0x22)
+        self.bus.read(0x0010)
+        self.bus.read(0x0011)
+        self.assertEqual(len(batches), 1)
+        self.bus.remove_observer(batches.append)
+        self.assertEqual([(a.addr, a.value, a.kind) for batch in batches for a in batch],
+                         [(0x0010, 0x22, WRITE), (0x0010, 0x22, READ), (0x0011, 0x00, READ)])
+        if not is_checked():
+            # checked builds put their wrappers back
+            self.assertNotIn('read', self.bus.__dict__)
+        self.bus.read(0x0010)
+        self.bus.flush_observers()
+        self.assertEqual(len(batches), 2)
+        # removing it again, or one never added, changes nothing
+        self.bus.remove_observer(batches.append)
+        self.bus.remove_observer(print)
+        PPU(video='null').remove_observer(print)
+        self.assertEqual(self.bus.read(0x0010), 0x22)
+        self.assertEqual(self.bus.trace_buffer, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
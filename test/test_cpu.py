@@ -0,0 +1,137 @@
+import random
+import unittest
+from pynes.cpu import CPU, FLAGS6502
+
+
+class RamBus:
+    def __init__(self, program=b'', origin=0x8000):
+        self.ram = [0] * 0x10000
+        self.ram[origin:origin + len(program)] = list(program)
+        self.ram[0xFFFC] = origin & 0xFF
+        self.ram[0xFFFD] = origin >> 8
+
+    def read(self, addr):
+        return self.ram[addr & 0xFFFF]
+
+    def write(self, addr, data):
+        self.ram[addr & 0xFFFF] = data
+
+
+class NoiseBus:
+    # pseudo random memory contents, only touched addresses are stored
+    def __init__(self, seed):
+        self.seed = seed
+        self.memory = {}
+
+    def read(self, addr):
+        addr &= 0xFFFF
+        if addr not in self.memory:
+            self.memory[addr] = (addr * 2654435761 + self.seed) >> 13 & 0xFF
+        return self.memory[addr]
+
+    def write(self, addr, data):
+        self.memory[addr & 0xFFFF] = data
+
+
+def make_cpu(program, **kwargs):
+    bus = RamBus(bytes(program))
+    cpu = CPU(**kwargs)
+    cpu.connect_bus(bus)
+    cpu.reset()
+    cpu.cycles = 0
+    return cpu, bus
+
+
+def run_instruction(cpu):
+    cpu.clock()
+    while cpu.cycles:
+        cpu.clock()
+
+
+class TestCPUMethods(unittest.TestCase):
+    def testDispatch(self):
+        cpu = CPU()
+        self.assertEqual(len(cpu.dispatch), 256)
+        addr_mode, operate, cycles, implied = cpu.dispatch[0x0A]
+        self.assertEqual((addr_mode.__name__, operate.__name__, cycles, implied), ('IMP', 'ASL', 2, True))
+        addr_mode, operate, cycles, implied = cpu.dispatch[0xBD]
+        self.assertEqual((addr_mode.__name__, operate.__name__, cycles, implied), ('ABX', 'LDA', 4, False))
+
+    def testShiftAccumulatorAndMemory(self):
+        # LDA #$81; ASL A; ASL $10
+        cpu, bus = make_cpu([0xA9, 0x81, 0x0A, 0x06, 0x10])
+        bus.ram[0x10] = 0x40
+        for _ in range(3):
+            run_instruction(cpu)
+        self.assertEqual(cpu.a, 0x02)
+        self.assertEqual(bus.ram[0x10], 0x80)
+        self.assertTrue(cpu.status & FLAGS6502.N)
+        self.assertFalse(cpu.status & FLAGS6502.C)
+
+    def testPageCrossCycles(self):
+        # LDX #$01; LDA $80FF,X
+        cpu, bus = make_cpu([0xA2, 0x01, 0xBD, 0xFF, 0x80])
+        run_instruction(cpu)
+        start = cpu.clock_count
+        run_instruction(cpu)
+        self.assertEqual(cpu.clock_count - start, 5)
+
+    def testStep(self):
+        # LDX #$01; LDA $7FFF,X; STA $0200
+        program = [0xA2, 0x01, 0xBD, 0xFF, 0x7F, 0x8D, 0x00, 0x02]
+        cpu, bus = make_cpu(program)
+        cpu.cycles = 8
+        self.assertEqual([cpu.step() for _ in range(4)], [8, 2, 5, 4])
+        self.assertEqual(bus.ram[0x0200], 0xA2)
+        stepped = cpu.clock_count
+        cpu, bus = make_cpu(program)
+        cpu.cycles = 8
+        for _ in range(19):
+            cpu.clock()
+        self.assertEqual((cpu.clock_count, cpu.cycles), (stepped, 0))
+
+    def testLazyFlags(self):
+        # LDA #$C0; BIT $10; PHP; PLA
+        cpu, bus = make_cpu([0xA9, 0xC0, 0x24, 0x10, 0x08, 0x68])
+        bus.ram[0x10] = 0x80
+        run_instruction(cpu)
+        self.assertEqual(cpu.status & (FLAGS6502.N | FLAGS6502.Z), FLAGS6502.N)
+        bus.ram[0x10] = 0x00
+        cpu.pc = 0x8002
+        run_instruction(cpu)
+        self.assertEqual(cpu.status & (FLAGS6502.N | FLAGS6502.Z | FLAGS6502.V), FLAGS6502.Z)
+        bus.ram[0x10] = 0xC0
+        cpu.a = 0x01
+        cpu.pc = 0x8002
+        run_instruction(cpu)
+        self.assertEqual(cpu.status & 0xC2, 0xC2)
+        run_instruction(cpu)
+        run_instruction(cpu)
+        self.assertEqual(cpu.a & 0xC2, 0xC2)
+        for status in range(256):
+            cpu.status = status
+            self.assertEqual(cpu.status, status | FLAGS6502.U)
+
+    def testFusedMatchesInterpreted(self):
+        rng = random.Random(6502)
+        cpus = (CPU(), CPU(fused=True))
+        for opcode in range(256):
+            for _ in range(30):
+                state = dict(a=rng.randrange(256), x=rng.randrange(256), y=rng.randrange(256),
+                             stkp=rng.randrange(256), status=rng.randrange(256), pc=rng.randrange(0x10000))
+                seed = rng.randrange(1 << 32)
+                results = []
+                for cpu in cpus:
+                    bus = NoiseBus(seed)
+                    bus.memory[state['pc']] = opcode
+                    cpu.connect_bus(bus)
+                    for name, value in state.items():
+                        setattr(cpu, name, value)
+                    cpu.cycles = 0
+                    cpu.clock_count = 0
+                    run_instruction(cpu)
+                    results.append((cpu.a, cpu.x, cpu.y, cpu.stkp, cpu.status, cpu.pc, cpu.clock_count, bus.memory))
+                self.assertEqual(results[0], results[1], f'opcode 0x{opcode:02x} from {state}')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+import unittest
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+from pynes import engine
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(engine.pygame is None, 'needs pygame')
+class TestEngine(unittest.TestCase):
+    def frame(self):
+        rgb = bytearray(256 * 240 * 3)
+        rgb[(1 * 256 + 1) * 3:(1 * 256 + 2) * 3] = bytes([10, 20, 30])
+        return bytes(rgb)
+
+    def testPresentScaled(self):
+        e = engine.Engine(scale=2)
+        e.present(self.frame())
+        self.assertEqual(e.screen.get_size(), (512, 480))
+        self.assertEqual(tuple(e.screen.get_at((3, 3)))[:3], (10, 20, 30))
+        self.assertEqual(tuple(e.screen.get_at((4, 4)))[:3], (0, 0, 0))
+        if np is not None:
+            e.present(np.asfortranarray(np.frombuffer(self.frame(), np.uint8).reshape(240, 256, 3)))
+            self.assertEqual(tuple(e.screen.get_at((2, 2)))[:3], (10, 20, 30))
+        engine.pygame.event.post(engine.pygame.event.Event(engine.pygame.QUIT))
+        e.update()
+        self.assertTrue(e.finished)
+
+    def testPace(self):
+        e = engine.Engine(pace=True)
+        ts = time.perf_counter()
+        for _ in range(4):
+            e.present(self.frame())
+        self.assertGreaterEqual(time.perf_counter() - ts, 3 / engine.FRAME_RATE)
+        engine.pygame.event.post(engine.pygame.event.Event(engine.pygame.QUIT))
+        e.update()
+
+    def testThreadedKeepsWindowOnMainThread(self):
+        e = engine.Engine(scale=2, pace=True)
+        threads = []
+        for name in ('open', 'show', 'flip', 'poll'):
+            method = getattr(e, name)
+            setattr(e, name, lambda *args, method=method: (threads.append(threading.current_thread()), method(*args))[1])
+        t = engine.ThreadedEngine(e)
+        ts = time.perf_counter()
+        for _ in range(4):
+            t.present(self.frame())
+        t.close()
+        self.assertGreaterEqual(time.perf_counter() - ts, 3 / engine.FRAME_RATE)
+        self.assertTrue(threads)
+        self.assertEqual(set(threads), {threading.main_thread()})
+        self.assertEqual(tuple(e.screen.get_at((3, 3)))[:3], (10, 20, 30))
+        engine.pygame.event.post(engine.pygame.event.Event(engine.pygame.QUIT))
+        e.update()
+
+
+class SlowEngine(engine.OffscreenEngine):
+    def __init__(self):
+        super().__init__()
+        self.shown = []
+
+    def present(self, frame):
+        time.sleep(0.02)
+        self.shown.append(frame[0])
+
+
+class ClosingEngine(engine.OffscreenEngine):
+    # finishes after showing one frame, like a window closed by the user
+    def present(self, frame):
+        super().present(frame)
+        self.finished = True
+
+
+class TestThreadedEngine(unittest.TestCase):
+    def run_frames(self, policy):
+        e = engine.ThreadedEngine(SlowEngine(), policy=policy)
+        for i in range(10):
+            e.present(bytes([i]) * (256 * 240 * 3))
+        e.close()
+        return e
+
+    def testBlock(self):
+        e = self.run_frames('block')
+        self.assertEqual((e.engine.shown, e.dropped), (list(range(10)), 0))
+
+    def testDrop(self):
+        e = self.run_frames('drop')
+        self.assertGreater(e.dropped, 0)
+        self.assertEqual(len(e.engine.shown) + e.dropped, 10)
+        self.assertEqual(e.engine.shown[0], 0)
+
+    def testOverwrite(self):
+        e = self.run_frames('overwrite')
+        self.assertGreater(e.dropped, 0)
+        self.assertEqual(len(e.engine.shown) + e.dropped, 10)
+        self.assertEqual(e.engine.shown[-1], 9)
+
+    def testPolicy(self):
+        with self.assertRaises(ValueError):
+            engine.ThreadedEngine(SlowEngine(), policy='wait')
+        with self.assertRaises(ValueError):
+            engine.ThreadedEngine(SlowEngine(), buffers=1)
+
+    def testFinishedBackend(self):
+        e = engine.ThreadedEngine(ClosingEngine())
+        for i in range(5):
+            e.present(bytes([i]) * (256 * 240 * 3))
+        e.close()
+        self.assertTrue(e.finished)
+        # the presenter stopped after one frame and at most one more was queued
+        self.assertEqual(e.engine.frames, 1)
+        self.assertGreaterEqual(e.dropped, 3)
+
+    def testIdle(self):
+        e = engine.ThreadedEngine(engine.NullEngine())
+        time.sleep(0.1)
+        e.close()
+        self.assertEqual(e.engine.frames, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
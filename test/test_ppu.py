@@ -1,5 +1,18 @@
+import random
 import unittest
+from pathlib import Path
+from types import SimpleNamespace
 from pynes import ppu
+from pynes.cartridge import Cartridge, HORIZONTAL, VERTICAL, ONESCREEN_HI, FOURSCREEN
+
+ROMS = Path(__file__).resolve().parent.parent / 'roms'
+
+
+def ppu_state(p):
+    return (p.scanline, p.cycle, p.status, p.vram_addr, p.bg_next_tile_id, p.bg_next_tile_lsb, p.bg_next_tile_attrib,
+            p.bg_shifter_pattern_lo, p.bg_shifter_pattern_hi, p.bg_shifter_attrib_lo, p.bg_shifter_attrib_hi,
+            bytes(p.spriteScanline), bytes(p.sprite_shifter_pattern_lo), p.sprite_count, p.nmi, p.odd_frame)
+
 
 class TestDeviceMethods(unittest.TestCase):
     def testSetflag(self):
@@ -9,5 +22,180 @@ class TestDeviceMethods(unittest.TestCase):
         expect = 0b111001
         self.assertEqual(ppu.set_flag(A, B, mask), expect)
 
+    def testPpuMemory(self):
+        p = ppu.PPU(video='offscreen')
+        p.cartridge = SimpleNamespace(ppuRead=lambda addr: False, ppuWrite=lambda addr, data: False, mirror=VERTICAL,
+                                      vNameMemory=bytearray(2048))
+        p.map_names()
+        p.ppuWrite(0x1234, 0x56)
+        self.assertEqual(p.tblPattern[0x1234], 0x56)
+        self.assertEqual(p.ppuRead(0x1234), 0x56)
+        p.ppuWrite(0x2C05, 0x78)
+        self.assertEqual(p.ppuRead(0x2405), 0x78)
+        p.cartridge.mirror = HORIZONTAL
+        p.map_names()
+        self.assertEqual(p.ppuRead(0x2805), 0x78)
+        self.assertEqual(p.ppuRead(0x2405), 0x00)
+        p.cartridge.mirror = ONESCREEN_HI
+        p.map_names()
+        self.assertEqual(p.ppuRead(0x2005), 0x78)
+        p.cartridge.mirror = FOURSCREEN
+        p.map_names()
+        p.ppuWrite(0x2C05, 0x9A)
+        self.assertEqual(p.ppuRead(0x2805), 0x00)
+        self.assertEqual(p.cartridge.vNameMemory[0x0405], 0x9A)
+        p.ppuWrite(0x3F10, 0x21)
+        self.assertEqual(p.ppuRead(0x3F00), 0x21)
+
+    def testFrameRgb(self):
+        p = ppu.PPU(video='offscreen')
+        p.sprScreen[:] = bytes(i % 64 for i in range(len(p.sprScreen)))
+        rgb = p.frame_rgb()
+        self.assertEqual(len(rgb), 256 * 240 * 3)
+        self.assertEqual(tuple(rgb[0x15 * 3:0x16 * 3]), ppu.palScreen[0x15])
+        p.mask = ppu.MASK_FLAG.grayscale | ppu.MASK_FLAG.enhance_red
+        rgb = p.frame_rgb()
+        r, g, b = ppu.palScreen[0x10]
+        self.assertEqual(tuple(rgb[0x15 * 3:0x16 * 3]), (r, int(g * ppu.EMPHASIS_DIM), int(b * ppu.EMPHASIS_DIM)))
+        dim = [int(value * ppu.EMPHASIS_DIM) for value in ppu.palScreen[0x16]]
+        table = ppu.rgb_table(ppu.MASK_FLAG.enhance_red | ppu.MASK_FLAG.enhance_green)
+        self.assertEqual(tuple(table[0x16 * 3:0x17 * 3]), ppu.palScreen[0x16][:2] + (dim[2],))
+        table = ppu.rgb_table(ppu.MASK_FLAG.enhance_red | ppu.MASK_FLAG.enhance_green | ppu.MASK_FLAG.enhance_blue)
+        self.assertEqual(list(table[0x16 * 3:0x17 * 3]), dim)
+        numpy, ppu.np = ppu.np, None
+        try:
+            self.assertEqual(p.frame_rgb(), rgb)
+        finally:
+            ppu.np = numpy
+
+    def testLineRendererMatchesDots(self):
+        cart = Cartridge(str(ROMS / 'helloworld.nes'))
+        results = []
+        for line_renderer in (False, True):
+            r = random.Random(7)
+            p = ppu.PPU(line_renderer=line_renderer, video='offscreen')
+            p.ConnectCartridge(cart)
+            p.tblName[:] = bytes(r.randrange(256) for _ in range(2048))
+            p.tblPalette[:] = bytes(r.randrange(64) for _ in range(32))
+            p.OAM[:] = bytes(r.randrange(240 if i % 4 == 0 else 256) for i in range(256))
+            p.OAM[0:4] = bytes([100, 1, 0, 8])
+            p.mask, p.control, p.fine_x, p.tram_addr = 0x1E, 0x80, 3, 0x1234
+            states = []
+            for ticks in (1000, 89342, 50000, 100000):
+                p.run(ticks)
+                states.append(ppu_state(p))
+                p.fine_x = r.randrange(8)
+            results.append((states, bytes(p.sprScreen)))
+        self.assertEqual(results[0], results[1])
+
+    def testTileCache(self):
+        cart = Cartridge(str(ROMS / 'helloworld.nes'))
+        p = ppu.PPU(video='null')
+        p.ConnectCartridge(cart)
+        for i in range(16):
+            p.ppuWrite(0x1230 + i, 0)
+        p.ppuWrite(0x1233, 0b10000001)
+        p.ppuWrite(0x123B, 0b00000011)
+        tile = cart.tile(p.chr_tiles[0x123])
+        self.assertEqual(tile.pixels[3], bytes([1, 0, 0, 0, 0, 0, 2, 3]))
+        self.assertEqual(tile.flipped_planes[3], 0b10000001)
+        self.assertEqual(tile.flipped_planes[11], 0b11000000)
+        p.ppuWrite(0x1233, 0)
+        self.assertEqual(cart.tile(p.chr_tiles[0x123]).pixels[3], bytes([0, 0, 0, 0, 0, 0, 2, 2]))
+
+    def testSpriteRows(self):
+        p = ppu.PPU(video='null')
+        p.OAM[:] = bytes([240, 0, 0, 0] * 64)
+        for n in range(10):
+            p.OAM[n * 4] = 20
+        p.scanline = 27
+        p.evaluate_sprites()
+        self.assertEqual((p.sprite_count, p.bSpriteZeroHitPossible), (8, True))
+        self.assertTrue(p.status & ppu.STATUS_FLAG.sprite_overflow)
+        p.write(0x0003, 0x00)
+        p.write(0x0004, 100)
+        p.evaluate_sprites()
+        self.assertEqual((p.sprite_count, p.bSpriteZeroHitPossible), (8, False))
+        self.assertTrue(p.status & ppu.STATUS_FLAG.sprite_overflow)
+        p.write(0x0003, 0x04)
+        p.write(0x0004, 100)
+        p.evaluate_sprites()
+        self.assertEqual(p.sprite_count, 8)
+        self.assertFalse(p.status & ppu.STATUS_FLAG.sprite_overflow)
+        self.assertEqual(p.sprite_rows()[100], [0, 1])
+        p.control = ppu.CONTROL_FLAG.sprite_size
+        self.assertEqual(p.sprite_rows()[35], list(range(2, 10)))
+
+    def testFrameSkip(self):
+        cart = Cartridge(str(ROMS / 'helloworld.nes'))
+        results = []
+        for render_every in (1, 3, 0):
+            r = random.Random(5)
+            p = ppu.PPU(video='offscreen', render_every=render_every, line_renderer=render_every == 3)
+            p.ConnectCartridge(cart)
+            p.tblName[:] = bytes(r.randrange(256) for _ in range(2048))
+            p.OAM[:] = bytes(r.randrange(256) for _ in range(256))
+            p.OAM[0:4] = bytes([100, 1, 0, 8])
+            p.mask, p.control = 0x1E, 0x80
+            states = []
+            for frame in range(6):
+                p.run(341 * 131)
+                states.append(ppu_state(p))
+                p.run(341 * 131)
+            if render_every == 0:
+                p.request_frame()
+                p.run(2 * 341 * 262)
+            results.append((p.frames_rendered, p.frames_skipped, states))
+        self.assertEqual(results[0][:2], (6, 0))
+        self.assertEqual(results[1][:2], (2, 4))
+        self.assertEqual(results[2][:2], (1, 7))
+        self.assertEqual(results[0][2], results[1][2])
+        self.assertEqual(results[0][2], results[2][2])
+
+    def testViewers(self):
+        cart = Cartridge(str(ROMS / 'helloworld.nes'))
+        r = random.Random(9)
+        p = ppu.PPU(video='offscreen')
+        p.ConnectCartridge(cart)
+        for addr in range(0x2000):
+            p.ppuWrite(addr, r.randrange(256))
+        p.tblName[:] = bytes(r.randrange(256) for _ in range(2048))
+        p.tblPalette[:] = bytes(r.randrange(64) for _ in range(32))
+        fast = bytes(p.GetPatternTable(1, 2))
+        numpy, ppu.np = ppu.np, None
+        try:
+            self.assertEqual(bytes(p.GetPatternTable(1, 2)), fast)
+        finally:
+            ppu.np = numpy
+        p.mask = 0x0A
+        p.run(2 * 341 * 262)
+        screen = ppu.np.frombuffer(p.frame_rgb(), ppu.np.uint8).reshape(240, 256, 3)
+        nametables = p.nametables_rgb()
+        self.assertEqual(nametables.shape, (480, 512, 3))
+        self.assertTrue((nametables[:240, :256] == screen).all())
+        mirror = (nametables[:240, 256:] if cart.mirror == HORIZONTAL else nametables[240:, :256])
+        self.assertTrue((mirror == screen).all())
+        p.OAM[:] = bytes(r.randrange(256) for _ in range(256))
+        self.assertEqual(p.sprites_rgb().shape, (64, 64, 3))
+        p.control = ppu.CONTROL_FLAG.sprite_size
+        self.assertEqual(p.sprites_rgb().shape, (128, 64, 3))
+
+    def testVideoBackends(self):
+        cart = Cartridge(str(ROMS / 'helloworld.nes'))
+        frames = []
+        for video in ('offscreen', 'null'):
+            p = ppu.PPU(video=video)
+            p.ConnectCartridge(cart)
+            p.tblPalette[:] = bytes(range(32))
+            p.mask = 0x1E
+            p.run(341 * 262)
+            self.assertEqual(p.engine.frames, 1)
+            frames.append(bytes(p.sprScreen))
+        self.assertEqual(p.engine.draws, False)
+        self.assertEqual(ppu.PPU(video='offscreen').engine.frame, bytes(256 * 240 * 3))
+        self.assertNotEqual(frames[0], frames[1])
+        with self.assertRaises(ValueError):
+            ppu.PPU(video='vga')
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
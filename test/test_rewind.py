@@ -0,0 +1,57 @@
+import unittest
+from pathlib import Path
+from pynes.bus import Bus
+from pynes.cartridge import Cartridge
+from pynes.cpu import CPU
+from pynes.ppu import PPU
+from pynes.rewind import Rewind, xor_bytes
+
+ROMS = Path(__file__).resolve().parent.parent / 'roms'
+
+
+class TestRewind(unittest.TestCase):
+    def setUp(self):
+        self.bus = Bus(video='null', catch_up=True)
+        self.bus.connect(CPU())
+        self.bus.connect(PPU())
+        self.bus.connect_cartridge(Cartridge(str(ROMS / 'starter.nes')))
+        self.bus.reset()
+
+    def testXorBytes(self):
+        self.assertEqual(xor_bytes(b'\x00\x0f\xff', b'\x00\xf0\xff'), b'\x00\xff\x00')
+        self.assertEqual(xor_bytes(b'\x00\x00', b'\x00\x00'), b'\x00\x00')
+
+    def testRewind(self):
+        rewind = Rewind(self.bus, keyframe_every=2)
+        states = []
+        for _ in range(4):
+            self.bus.run_frames(1)
+            states.append(self.bus.save_state())
+        self.assertEqual(len(rewind), 4)
+        self.assertEqual([len(deltas) for _, deltas in rewind.groups], [2, 0])
+        rewind.rewind(2)
+        self.assertEqual(self.bus.save_state(), states[2])
+        rewind.rewind()
+        self.assertEqual(self.bus.save_state(), states[1])
+        self.bus.run_frames(1)
+        self.assertEqual(self.bus.save_state(), states[2])
+        rewind.rewind(2)
+        self.assertEqual(self.bus.save_state(), states[0])
+        self.assertEqual(len(rewind), 0)
+        with self.assertRaises(ValueError):
+            rewind.rewind()
+
+    def testBudget(self):
+        rewind = Rewind(self.bus, interval=2, budget=1, keyframe_every=1)
+        self.bus.run_frames(6)
+        self.assertEqual(len(rewind), 1)
+        self.assertEqual(rewind.size, len(rewind.groups[0][0]))
+        stats = rewind.stats()
+        self.assertEqual((stats.snapshots, stats.captures), (1, 3))
+        self.assertGreater(stats.per_capture, 0)
+
+    def testArguments(self):
+        for arguments in (dict(interval=0), dict(interval=-1), dict(budget=0), dict(keyframe_every=0)):
+            with self.assertRaises(ValueError):
+                Rewind(self.bus, **arguments)
+        self.assertIsNone(self.bus.rewind)